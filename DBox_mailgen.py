@@ -1,480 +1,44 @@
+import os
+import uuid
+# First, so the startup timings start with the script
+from mailgen_warmup import record_startup, start_warmup, startup_stats
 import streamlit as st
-from langchain_openai import ChatOpenAI
-from langchain.chains import LLMChain
-from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
 from datetime import datetime
-from langdetect import detect
-import openai
+from mailgen_agents import (MAX_CANDIDATES, PIPELINE_DEPTH, PIPELINE_DEPTHS, get_demands, get_demands_cache, organization_for, run_reply_job,
+                            target_language_for, translate_email)
+from mailgen_cache import content_key
+from mailgen_classifier import get_classifier
+from mailgen_dedup import get_reply_index
+from mailgen_jobs import DONE, FAILED, get_job_runner
+from mailgen_language import LANGUAGES, detect_language, is_ambiguous
+from mailgen_library import get_library
+from mailgen_metrics import metrics, set_session, start_metrics_server
+from mailgen_preprocess import clean_email
+from mailgen_router import get_router
+from mailgen_tasks import StageGraph, submit
+from mailgen_validate import get_validator
 
 st.set_page_config(layout="wide")
-openai.api_key = st.secrets["OPENAI_API_KEY"]
+# langchain and openai pick the key up from the environment when they are first used
+os.environ["OPENAI_API_KEY"] = st.secrets["OPENAI_API_KEY"]
+record_startup("import")
+# Heavy libraries and clients load in the background while the password prompt is shown
+start_warmup()
 
-# AI agent functions
-def detect_demands(email_content):
-    system_template = "You are an AI assistant specialized in analyzing emails and identifying the main demands or requests made by the sender."
-    human_template = """
-    Analyze the following email and identify the main demands or requests made by the sender. 
-    Categorize them into one or more of these types: data change, tax certificate, donation adjustment, complaint, donation cancellation, unsubscribe, or general inquiry.
-    If multiple demands are present, list them all.
+# Translate the incoming email and the generated reply in the background, ahead of the button click
+PREFETCH_TRANSLATIONS = os.environ.get("MAILGEN_PREFETCH_TRANSLATIONS", "1") == "1"
 
-    Email content:
-    {email_content}
-
-    Detected demands (comma-separated list):
-    """
-
-    chat_prompt = ChatPromptTemplate.from_messages([
-        SystemMessagePromptTemplate.from_template(system_template),
-        HumanMessagePromptTemplate.from_template(human_template)
-    ])
-
-    llm = ChatOpenAI(model_name="gpt-4o", temperature=0.5)
-    chain = LLMChain(llm=llm, prompt=chat_prompt)
-
-    demands = chain.run(email_content=email_content).strip().split(', ')
-    return demands
-
-def select_relevant_responses(demands, examples, email_content, donor_info, actions, additional_messages, additional_guidelines):
-    template = """
-    Given the following information, search through the provided examples to get inspiration. 
-    
-    Email content:
-    {email_content}
-
-    Detected demands:
-    {demands}
-
-    Donor Information:
-    {donor_info}
-
-    Actions taken:
-    {actions}
-
-    Additional messages to include:
-    {additional_messages}
-
-    Additional guidelines to follow:
-    {additional_guidelines}
-    
-    Examples:
-    {examples}
-
-    Based on the examples, suggest pertinent response parts, focusing on addressing the detected demands 
-    and considering the donor information, actions taken, additional messages and additional guidelines.
-
-    Please format your response as follows:
-    1. List the top 3-5 most relevant response parts in order of importance. 
-    2. For each part, provide a brief explanation of why it's relevant.
-    3. If no exact matches are found in the examples, suggest appropriate response parts based on the given context.
-    4. If absolutely no relevant information is found, state this clearly and suggest a general approach for responding.
-
-    Your response:
-    """
-
-    prompt = ChatPromptTemplate.from_messages([
-        SystemMessagePromptTemplate.from_template("You are an AI assistant specialized in selecting or suggesting relevant response parts for email inquiries based on various contextual factors. Your goal is to provide the most appropriate and helpful response elements."),
-        HumanMessagePromptTemplate.from_template(template)
-    ])
-
-    llm = ChatOpenAI(model_name="gpt-4o", temperature=0.5)
-    chain = LLMChain(llm=llm, prompt=prompt)
-
-    relevant_responses = chain.run(email_content=email_content, demands=demands, donor_info=donor_info, 
-                                   actions=actions, additional_messages=additional_messages, examples=examples, additional_guidelines=additional_guidelines)
-    return relevant_responses
-
-
-def draft_initial_response(email_content, actions, additional_messages, additional_guidelines, donor_info, relevant_responses, language, name, organization):
-    template = """
-    Based on the following information, draft an engaging and respectful email response in {language}:
-    
-    Original Email: {email_content}
-    Actions Taken: {actions}
-    Additional Messages to Include: {additional_messages}
-    Additional Guidelines to Follow: {additional_guidelines}
-    Donor Information: {donor_info}
-    Relevant Response Parts: {relevant_responses}
-    Your Name: {name}
-    Organization: {organization}
-    
-    Guidelines for drafting the response:
-    1. Draft a response that is engaging, constructive, helpful, and respectful.
-    2. Draw inspiration from the relevant response parts provided but NEVER just literally translate them. Capture the ideas and draft them in {language} as if you would think of them from scratch in {language}.
-    3. Utilize the detailed donor information to personalize the response appropriately.
-    4. Follow the additional guidelines.
-    5. Avoid controversy, ambiguity, or politically oriented responses. Maintain a positive tone throughout the email.
-    6. Address all the demands detected in the original email.
-    7. Include the additional messages as appropriate within the context of the response.
-    8. Conclude with a positive note and/or a thank you.
-    9. Use appropriate salutations and sign-off for the email, that are known and commonly used in {language}.
-    10. Include the provided name and organization in the signature.
-    
-    Complete response:
-    """
-    
-    prompt = ChatPromptTemplate.from_messages([
-        SystemMessagePromptTemplate.from_template(f"You are an AI assistant specialized in drafting email responses in {language}, with a focus on donor communication."),
-        HumanMessagePromptTemplate.from_template(template)
-    ])
-    
-    llm = ChatOpenAI(model_name="gpt-4o", temperature=0.5)
-    chain = LLMChain(llm=llm, prompt=prompt)
-    
-    return chain.run(email_content=email_content, actions=actions, additional_messages=additional_messages,
-                     donor_info=donor_info, relevant_responses=relevant_responses, language=language,
-                     name=name, organization=organization, additional_guidelines=additional_guidelines)
-
-
-def refine_response(draft_response, donor_info, language, name, organization, temperature):
-    system_template = f"You are an expert fundraiser specialized in refining email responses in {language}, with a deep understanding of donor psychology and effective communication strategies."
-    human_template = """
-    Refine the following email draft:
-    
-    Draft: {draft_response}
-    Donor Information: {donor_info}
-    Your Name: {name}
-    Organization: {organization}
-    
-    Guidelines for refinement:
-    1. Preserve all content elements and messages conveyed in the original draft. Also, DO NOT ADD extra information.
-    2. Adapt the phrasing and structure to maximize positive effects on the reader (donor).
-    3. Enhance the fluidity and authenticity of the language used, ensuring the email sounds completely natural and seamless for a native speaker of {language}. 
-    4. Optimize the email's impact by improving its overall coherence and persuasiveness. Eliminate unnecessary repetitions, and ensure the message is concise.
-    5. Ensure the tone remains appropriate for the donor type and situation, while being direct and to-the-point.
-    6. Make sure the signature includes the provided name and organization.
-
-    Your task is to refine the form and style of the email while keeping its core content intact. 
-    The goal is to make the email more engaging, impactful, and donor-centric without altering its fundamental message or omitting any important information.
-    
-    Complete refined response:
-    """
-    
-    chat_prompt = ChatPromptTemplate.from_messages([
-        SystemMessagePromptTemplate.from_template(system_template),
-        HumanMessagePromptTemplate.from_template(human_template)
-    ])
-    
-    llm = ChatOpenAI(model_name="gpt-4o", temperature=temperature)
-    chain = LLMChain(llm=llm, prompt=chat_prompt)
-        
-    return chain.run(draft_response=draft_response, donor_info=donor_info, language=language, name=name, organization=organization)
-
-def translate_email(email_content, source_language, target_language):
-    system_template = f"You are a professional translator specializing in translating from {source_language} to {target_language}."
-    human_template = """
-    Translate the following text:
-    
-    {email_content}
-    
-    Ensure that the translation maintains the tone and intent of the original message, accurately reflects its content, and is perfectly fluent.
-    """
-    
-    chat_prompt = ChatPromptTemplate.from_messages([
-        SystemMessagePromptTemplate.from_template(system_template),
-        HumanMessagePromptTemplate.from_template(human_template)
-    ])
-    
-    llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.3)
-    chain = LLMChain(llm=llm, prompt=chat_prompt)
-    
-    return chain.run(email_content=email_content)
-
-# Example data for replies
-examples = """
-
-### EXAMPLES OF DATA CHANGE REQUESTS
-
-***Response***
-Dear [Name],
-
-Please email us your new bank account number. We will update our system to ensure your donations continue from the new account. 
-
-Thank you for your invaluable support. Your contributions make a significant difference for those in need. 
-
-Feel free to reach out with any further questions.
-
-With solidarity,
-[Your Name]
-
----
-***Response***
-
-Dear [firstname],
-
-Thank you for your valuable support since [date]! We have updated your address in our database, and you will now receive our communications at your new address.
-
-Thank you for standing by our side!
-
-Warm regards,
-[Your Name]
-
----
-***Response***
-
-Dear [name],
-
-Thank you for informing us about your address change. We have updated it in our system, and you will now receive our communications at the new address.
-
-Thank you for your loyal support. It is invaluable in helping the most vulnerable.
-
-Take care, and feel free to contact us with any further questions.
-
-Kind regards,
-[Your Name]
-
----
-***Response***
-
-Dear [name],
-
-Thank you for your email. We have updated your bank account number in our database. Future direct debits will be processed from the new account.
-
-Thank you for your loyal support. It allows us to provide urgent care to those in need.
-
-If you have any further questions, please let us know.
-
-Kind regards,
-[Your Name]
-
-### EXAMPLES OF TAX CERTIFICATE REQUESTS
-
-***Response***
-
-Dear [name],
-
-Tax certificates are automatically sent at the end of February or beginning of March. Yours will be delivered digitally, so please check your spam folder as well. 
-
-If you haven't received it by March 15, please let us know.
-
-Thank you for your loyal support. It significantly helps us assist the most vulnerable.
-
-Kind regards,
-[Your Name]
-
----
-***Response***
-
-Dear [firstname],
-
-We have sent you a tax certificate digitally, but it might have ended up in your spam folder. Attached, you will find a duplicate of your tax certificate.
-
-Please contact us again if you need further assistance. We are here to help.
-
-Thank you for your support, which enables us to help vulnerable people.
-
-With solidarity,
-[Your Name]
-
----
-***Response***
-
-Dear [name],
-
-Thank you for your donation at [date]. Your support helps us continue our work with vulnerable people.
-
-The tax certificate will be automatically emailed to you between February and March.
-
-If you have any further questions, please contact us. We are happy to assist you.
-
-Kind regards,
-[Your Name]
-
-### EXAMPLES OF DONATION ADJUSTMENTS
-
-***Response***
-
-Dear [name],
-
-As requested, we have reduced your monthly donation from €[amount] to €[amount]. We appreciate your continued support, even at a reduced amount. 
-
-If you have any further questions, please let us know. 
-
-Take care of yourself and those who are close to you.
-
-With solidarity,
-[Your Name]
-
-### EXAMPLES OF DONATION CANCELLATION
-
-***Response***
-
-Dear Ms. [Name],
-
-Thank you for your email.
-
-As requested, we have canceled your authorization, ensuring that no automatic payments will be processed.
-
-While we respect and understand your decision, we deeply regret losing your support so soon. Your contribution is vital to our mission, enabling us to develop projects that support vulnerable communities.
-
-Should you have any further questions or require assistance, please do not hesitate to reach out. We are always here to help.
-
-We also hope you continue to follow our work through social media or our newsletters. Should you wish to become a donor again, whether through a one-time or monthly contribution, you can easily do so on our website at www.doktersvandewereld.be [IF LANGUAGE == "nl"] / www.medecinsdumonde.be [IF LANGUAGE == "fr"].
-
-Kind regards,
-
----
-***Response***
-
-Dear Ms. [Name],
-
-Thank you for your email.
-
-We have received your request and promptly canceled your authorization, ensuring no automatic payments will occur.
-
-We understand your concerns and apologize if our communication was unclear. Your feedback is invaluable and helps us improve our interactions with future donors.
-
-If you have any further questions, please feel free to contact us. We are here to assist you.
-
-We hope you continue to follow our work through social media or our newsletters.
-
-Thank you again for your understanding.
-
-Best regards,
-
----
-***Response***
-
-Dear [name],
-
-Thank you for your email.
-
-As requested, we have canceled your authorization, ensuring no payments will be processed. We understand and respect your decision and appreciate your initial interest in supporting our organization.
-
-If you have any further questions, please do not hesitate to contact us. We are always here to assist you.
-
-We hope you continue to follow our work through social media or our newsletter.
-
-Wishing you a pleasant day.
-
-With solidarity,
-
----
-***Response***
-
-Dear [name],
-
-Thank you for your email. 
-
-We have canceled your direct debit. There will be no more automatic payments.
-
-Thank you for your past support  It has been crucial in helping the most vulnerable. [ONLY IF DONOR INFORMATION SAYS PREVIOUS GIFTS HAVE BEEN MADE]
-
-Take care and have a nice day.
-
-Warm regards,
-[Your Name]
-
----
-***Response***
-
-Dear [name],
-
-We have received your request to cancel your direct debit. As requested, it has been canceled, and there will be no automatic payments.
-
-We understand your decision but are sorry to lose your support so soon. Every bit of support helps us develop projects and assist vulnerable people.
-
-If you are still interested in our work, you can visit our website for more information or to make a one-time donation.
-
-If you have any further questions, please contact us. We are happy to assist you.
-
-Kind regards,
-[Your Name]
-
----
-***Response***
-
-Dear [firstname],
-
-Thank you for your message and feedback. We apologize for any miscommunication. Indeed, it concerns monthly donations. We will address this with our field recruiters to prevent future misunderstandings.
-
-We have canceled your direct debit, and no payments will be initiated.
-
-If you have any additional questions, please contact us. We are here to help.
-
-Have a nice day.
-
-Kind regards,
-[Your Name]
-
----
-***Response***
-
-Dear [name],
-
-Thank you for your email. As requested, we have canceled your direct debit, and there will be no more automatic payments.
-
-We sincerely thank you for your long and loyal support. It has made a significant difference for those without access to care.
-
-We hope you will continue to follow us on social media or other channels. Making a one-time donation or becoming a donor again is easy via our website.
-
-If you have any further questions, please contact us. We are happy to assist you.
-
-Have a nice day.
-
-Best regards,
-[Your Name]
-
----
-***Response***
-
-Dear [Name],
-
-Thank you for your email. We understand your decision and have canceled your mandate, so no automatic payments will be made. 
-
-It's great that you support multiple NGOs. If you ever consider adding us to your list, you know where to find us: www.doktersvandewereld.be [IF LANGUAGE == "nl"] or www.medecinsdumonde.be [IF LANGUAGE == "fr"]
-
-You can follow our projects on social media or through our monthly newsletter.
-
-Have a nice day.
-
-Kind regards,
-[Your Name]
-
-### EXAMPLES OF UNSUBSCRIBING FROM COMMUNICATION
-
-***Response***
-
-Dear [name],
-
-Thank you for your email and for sharing your thoughts. We understand your feelings and appreciate your feedback.
-
-Please know that we are very grateful for your support. It is thanks to donors like you that we can continue our work.
-
-We have updated our system to stop sending you emails about our actions or donation requests.
-
-If you have any further questions, please contact us. We are here to ensure our cooperation meets your expectations.
-
-Best regards,
-[Your Name]
-
----
-***Response***
-
-Dear [firstname],
-
-Thank you for your support! Your communication preference has been updated. You will now receive only emails from us.
-
-Thank you for standing by our side!
-
-Warm regards,
-[Your Name]
-
----
-***Response***
-
-Dear Klaas,
-
-Thank you for your message. We have updated our database, and you will no longer receive postal mail from us. We will send further communications via email.
-
-If you have specific preferences, please let us know.
-
-Have a nice day.
-
-Kind regards,
-[Your Name]
-"""
+start_metrics_server()
 
 def reset_app():
+    # Drop work still running for this session before clearing it
+    if st.session_state.get("analysis_graph") is not None:
+        st.session_state.analysis_graph.cancel()
+    if st.session_state.get("reply_translation") is not None:
+        st.session_state.reply_translation.cancel()
+    if st.session_state.get("generation_job") is not None:
+        get_job_runner().cancel(st.session_state.generation_job)
+
     # Clear all session state variables
     for key in list(st.session_state.keys()):
         del st.session_state[key]
@@ -492,6 +56,7 @@ def main():
     PASSWORD = st.secrets["MDM_PASSWORD"]
         
     pass_word = st.sidebar.text_input('**Enter the password:**')
+    record_startup("first_render")
     if st.sidebar.button("Reset App"):
         reset_app()
         st.rerun()
@@ -507,6 +72,10 @@ def main():
     
     st.title("Multiagent AI Email System")
 
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    set_session(st.session_state.session_id)
+
     # Initialize session state
     
     
@@ -524,26 +93,69 @@ def main():
         st.session_state.translated_original_mail = None
 
     # Input email
-    email_content = st.text_area("Paste the incoming email here:")
+    raw_email = st.text_area("Paste the incoming email here:")
+    strip_history = st.checkbox("Leave out quoted replies, signatures and disclaimers", value=True)
+
+    # Only the donor's own message goes to the AI agents; the pasted text stays as is above
+    email_content = raw_email
+    if raw_email and strip_history:
+        cleaned_email = clean_email(raw_email)
+        email_content = cleaned_email.text
+        if cleaned_email.removed:
+            with st.expander(f"Left out of the analysis (~{cleaned_email.tokens_saved} tokens saved per AI call)"):
+                st.text("\n\n".join(cleaned_email.removed))
 
     # Detect language
     if email_content:
-        st.session_state.detected_language = detect(email_content)
-        st.write(f"Detected language: {st.session_state.detected_language}")
+        language_result = detect_language(email_content)
+        st.session_state.detected_language = language_result.language
+        if is_ambiguous(language_result):
+            # Mixed or unclear emails are left to the agent instead of silently picking one
+            scores = ", ".join(f"{language} {probability:.0%}" for language, probability in language_result.probabilities.items())
+            st.warning(f"The language of this email is mixed or unclear ({scores or 'no text to go on'}). Please check the reply language.")
+            st.session_state.detected_language = st.radio("Reply language:", LANGUAGES, index=LANGUAGES.index(language_result.language), horizontal=True)
+        else:
+            st.write(f"Detected language: {st.session_state.detected_language}")
 
         # Set target language based on detected language
-        st.session_state.target_language = "Dutch" if st.session_state.detected_language == "fr" else "French"
+        st.session_state.target_language = target_language_for(st.session_state.detected_language)
+
+        # Demand detection and translation of the original email don't depend on
+        # each other, so run them side by side; a new email cancels the previous run,
+        # and a run that failed or was cancelled is started again on the next rerun
+        analysis_key = content_key(email_content, st.session_state.target_language)
+        analysis_graph = st.session_state.get("analysis_graph")
+        if st.session_state.get("analysis_key") != analysis_key or analysis_graph is None or analysis_graph.failed():
+            if analysis_graph is not None:
+                st.session_state.analysis_graph.cancel()
+            detected_language = st.session_state.detected_language
+            target_language = st.session_state.target_language
+            graph = StageGraph()
+            graph.add("demands", lambda: get_demands(email_content))
+            if PREFETCH_TRANSLATIONS:
+                graph.add("translation", lambda: translate_email(email_content, detected_language, target_language))
+            st.session_state.analysis_graph = graph.start()
+            st.session_state.analysis_key = analysis_key
+            st.session_state.translated_original_mail = None
 
         # Detect demands
         with st.spinner("Analyzing email..."):
-            demands = detect_demands(email_content)
+            demands = st.session_state.analysis_graph.result("demands")
 
         # st.subheader("Detected Demands")
         # st.write(demands)
 
+        cache_stats = get_demands_cache().stats()
+        st.sidebar.caption(f"Email analysis cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+
     # Translation option
     if st.button("Translate the original email"):
-        st.session_state.translated_original_mail = translate_email(email_content, st.session_state.detected_language, st.session_state.target_language)
+        analysis_graph = st.session_state.get("analysis_graph")
+        if analysis_graph is not None and "translation" in analysis_graph.nodes:
+            with st.spinner("Translating..."):
+                st.session_state.translated_original_mail = analysis_graph.result("translation")
+        else:
+            st.session_state.translated_original_mail = translate_email(email_content, st.session_state.detected_language, st.session_state.target_language)
 
     # Display translated response
     if st.session_state.translated_original_mail:
@@ -592,41 +204,176 @@ def main():
     # Signature
     st.subheader("Email Signature")
     name = st.text_input("Your Name:")
-    organization = "Dokters van de Wereld" if st.session_state.detected_language == "nl" else "Médecins du Monde"
+    organization = organization_for(st.session_state.detected_language)
     set_temperature = st.slider('**Select the TEMPERATURE of the latest AI agent:**', min_value=0.1, max_value=0.9, step=0.1, value=0.3) 
+    force_fresh = st.checkbox("Force a fresh generation (ignore previously stored answers)")
+    stream_output = st.checkbox("Show the response while it is being written", value=True)
+    pipeline_depth = st.selectbox("AI steps per response", PIPELINE_DEPTHS, index=PIPELINE_DEPTHS.index(PIPELINE_DEPTH),
+                                  format_func=lambda depth: {3: "3 - select, draft and refine (most careful)",
+                                                             2: "2 - select and draft together, then refine",
+                                                             1: "1 - single pass (fastest)"}[depth])
+    # Several refinements of one draft cost a single extra request, not a full rerun per try
+    candidates = st.selectbox("Refined versions to choose from", range(1, MAX_CANDIDATES + 1), disabled=pipeline_depth == 1,
+                              help="Alternatives are written from the same draft in one request and shown side by side.")
     
-    # Draft initial response
+    # A campaign wave brings in many near-identical emails: offer a reply approved
+    # for an earlier one, filled in for this donor, instead of running the agents again
+    if email_content and not force_fresh:
+        earlier_reply = get_reply_index().find(email_content, st.session_state.detected_language, name, organization, donor_info)
+        if earlier_reply is not None:
+            similarity, reply = earlier_reply
+            st.info(f"A near-identical email ({similarity:.0%} similar) was answered before with an approved reply.")
+            with st.expander("Show the earlier reply"):
+                st.text(reply)
+            if st.button("Use the earlier reply"):
+                metrics.record("near_duplicate", "approved-reply", 0.0, 0, 0, True, similarity=similarity)
+                set_generated_response(reply)
+
+    # Draft initial response. The pipeline runs as a background job, so touching a
+    # widget meanwhile doesn't lose the work: the next rerun picks the result up
     if st.button("Generate Response"):
-        with st.spinner("Generating response..."):
-            # Select relevant responses
-            relevant_responses = select_relevant_responses(demands, examples, email_content, donor_info, actions, additional_messages, additional_guidelines)
-            
-            # st.subheader("Relevant Response Parts")
-            # st.write(relevant_responses)
-            
-            initial_draft = draft_initial_response(email_content, actions, additional_messages, additional_guidelines, donor_info, relevant_responses, st.session_state.detected_language, name, organization)
-           
-            # st.subheader("First draft")
-            # st.write(initial_draft)
-
-            refined_response = refine_response(initial_draft, donor_info, st.session_state.detected_language, name, organization, set_temperature)
-             
-            st.session_state.generated_response = refined_response
+        if st.session_state.get("generation_job") is not None:
+            get_job_runner().cancel(st.session_state.generation_job)
+        # Keep the selection, draft and refinement of the previous run and only
+        # redo the stages whose inputs changed (e.g. a new temperature only reruns the refinement)
+        artifacts = st.session_state.setdefault("artifacts", {})
+        if force_fresh:
+            artifacts.clear()
+        st.session_state.generation_job = get_job_runner().submit(
+            run_reply_job, dict(artifacts), demands, email_content, donor_info, actions, additional_messages, additional_guidelines,
+            st.session_state.detected_language, name, organization, set_temperature, pipeline_depth,
+            stream=stream_output, use_cache=not force_fresh, candidates=1 if pipeline_depth == 1 else candidates,
+            session=st.session_state.session_id)
+
+    if st.session_state.get("generation_job") is not None:
+        show_generation_job(stream_output)
+    if st.session_state.get("generation_error"):
+        st.error(f"Generating the response failed: {st.session_state.pop('generation_error')}")
+    reused = st.session_state.pop("reused_stages", None)
+    if reused:
+        st.caption(f"Unchanged inputs, reused from the previous run: {', '.join(reused)}. Tick 'Force a fresh generation' to redo every step.")
+
+    # Alternatives from one refinement request, side by side; the first one is preselected
+    reply_candidates = st.session_state.get("reply_candidates")
+    if reply_candidates:
+        st.subheader("Refined Versions")
+        candidate_problems = st.session_state.get("reply_candidate_problems") or [[] for _ in reply_candidates]
+        for i, (column, candidate, problems) in enumerate(zip(st.columns(len(reply_candidates)), reply_candidates, candidate_problems)):
+            with column:
+                st.text_area(f"Version {i + 1}", value=candidate, height=400, disabled=True)
+                # A version that breaks the reply rules can't replace the checked response
+                if problems:
+                    st.warning("Breaks the reply rules: " + ", ".join(problems))
+                if st.button("Use this version", key=f"use_reply_candidate_{i}", disabled=bool(problems)):
+                    set_generated_response(candidate)
 
     # Display generated response
     if st.session_state.generated_response:
         st.subheader("AI Generated Email Response")
-        st.text_area("Final Response", value=st.session_state.generated_response, height=500)
-        st.write("**If the response doesn't meet your expectations, please rerun the tool. In about 20% of cases, AI performance might fall short or become inconsistent. Consider adjusting your inputs in the text areas before rerunning. Requesting a direct tone in the guidelines can be particularly effective, especially in Dutch.**")
+        final_response = st.text_area("Final Response", value=st.session_state.generated_response, height=500)
+        if st.button("Approve this reply for near-identical emails"):
+            if get_reply_index().add(email_content, final_response, st.session_state.detected_language, name, organization, donor_info) is None:
+                st.warning("Not saved: a donor detail appears in this reply in a way that can't be replaced safely for other donors.")
+            else:
+                st.success("Saved. It will be offered for near-identical emails with the same language and donor type.")
+        st.write("**If the response doesn't meet your expectations, please rerun the tool or ask for several refined versions to choose from. In about 20% of cases, AI performance might fall short or become inconsistent. Consider adjusting your inputs in the text areas before rerunning. Requesting a direct tone in the guidelines can be particularly effective, especially in Dutch.**")
         
         # Translation option
         if st.button("Translate the generated email"):
-            st.session_state.translated_response = translate_email(st.session_state.generated_response, st.session_state.detected_language, st.session_state.target_language)
+            translated = None
+            prefetched = st.session_state.get("reply_translation")
+            if prefetched is not None and not prefetched.cancelled():
+                with st.spinner("Translating..."):
+                    if prefetched.exception() is None:
+                        translated = prefetched.result()
+            if translated is None:
+                # The prefetch failed or was cancelled (API error, rate limit): translate now instead of raising its error on every click
+                st.session_state.reply_translation = None
+                translated = translate_email(st.session_state.generated_response, st.session_state.detected_language, st.session_state.target_language, memory=True)
+            st.session_state.translated_response = translated
 
         # Display translated response
         if st.session_state.translated_response:
             st.subheader(f"Translated Reply ({st.session_state.target_language})")
             st.write(st.session_state.translated_response)
+
+    # Performance metrics
+    if st.sidebar.checkbox("Show performance metrics"):
+        show_metrics()
+
+@st.fragment(run_every=0.5)
+def show_generation_job(stream_output):
+    # Polls the session's job; once it is finished the whole app reruns to show the response
+    job = get_job_runner().get(st.session_state.generation_job)
+    if job is None:
+        st.session_state.generation_job = None
+        return
+    if not job.finished:
+        progress = job.snapshot()
+        st.caption(f"{progress['step']} ({progress['seconds']:.0f}s)")
+        if stream_output and progress["partial"]:
+            st.write(progress["partial"])
+        return
+    st.session_state.generation_job = None
+    if job.status == DONE:
+        st.session_state.artifacts = job.result["artifacts"]
+        st.session_state.reused_stages = job.result["reused"]
+        st.session_state.reply_candidates = job.result["candidates"] if len(job.result["candidates"]) > 1 else None
+        st.session_state.reply_candidate_problems = job.result["candidate_problems"]
+        set_generated_response(job.result["response"])
+    elif job.status == FAILED:
+        st.session_state.generation_error = job.error
+    st.rerun()
+
+def set_generated_response(response):
+    if response == st.session_state.generated_response:
+        return
+    st.session_state.generated_response = response
+    st.session_state.translated_response = None
+
+    if st.session_state.get("reply_translation") is not None:
+        st.session_state.reply_translation.cancel()
+    st.session_state.reply_translation = None
+    if PREFETCH_TRANSLATIONS:
+        st.session_state.reply_translation = submit(translate_email, response, st.session_state.detected_language, st.session_state.target_language, memory=True)
+
+def show_metrics():
+    session_rows = metrics.summary(st.session_state.session_id)
+    process_rows = metrics.summary()
+    st.sidebar.write("**This session**")
+    if session_rows:
+        st.sidebar.dataframe(session_rows, hide_index=True)
+        st.sidebar.caption(f"Estimated cost: ${sum(row['cost'] for row in session_rows):.4f}")
+        prompt_tokens = sum(row['prompt_tokens'] for row in session_rows)
+        if prompt_tokens:
+            st.sidebar.caption(f"Prompt tokens served from OpenAI's prompt cache: {sum(row['cached_tokens'] for row in session_rows) / prompt_tokens:.0%}")
+    else:
+        st.sidebar.caption("No calls yet.")
+    st.sidebar.write("**All sessions**")
+    st.sidebar.dataframe(process_rows, hide_index=True)
+    st.sidebar.caption(f"Estimated cost: ${sum(row['cost'] for row in process_rows):.4f}")
+    classifier_stats = get_classifier().stats()
+    st.sidebar.caption(f"Demands answered locally: {classifier_stats['fast_path']}, sent to the LLM: {classifier_stats['fallbacks']} "
+                       f"(fallback rate {classifier_stats['fallback_rate']:.0%})")
+    validation = get_validator().stats()
+    if validation["checked"]:
+        st.sidebar.caption(f"Replies passing the rule check: {validation['pass_rate']:.0%}, fixed locally: {validation['fixed_locally']}, "
+                           f"sent to a repair call: {validation['repair_rate']:.0%} ({validation['repair_success_rate']:.0%} repaired)")
+    routing = get_router().stats()
+    if routing:
+        st.sidebar.write("**Model routing**")
+        st.sidebar.dataframe(routing, hide_index=True)
+    library = get_library().stats()
+    st.sidebar.caption(f"Prompt library {library['version']}: {library['templates']} templates, {library['examples']} example responses "
+                       f"in {library['categories']} categories")
+    for path, error in library["errors"].items():
+        st.sidebar.warning(f"{os.path.basename(path)} could not be loaded, its previous version is used: {error}")
+    startup = startup_stats()
+    st.sidebar.caption(f"Startup: app imports {startup.get('import', 0):.2f}s, first render {startup.get('first_render', 0):.2f}s, "
+                       + (f"background warm-up {startup['warmup']:.2f}s" if startup["warmed_up"] else "warm-up still running"))
+    job_stats = get_job_runner().stats()
+    st.sidebar.caption(f"Background generations: {job_stats['running']} running, {job_stats['queued']} queued")
+    st.sidebar.download_button("Download trace (JSON lines)", metrics.to_jsonl(), file_name="mailgen_trace.jsonl")
             
       
 if __name__ == "__main__":
@@ -0,0 +1,57 @@
+# Per-call setup overhead: building ChatOpenAI + prompt + LLMChain on every call
+# (the old agent functions) versus reusing the process-wide chain registry.
+# No request is sent; only object construction and prompt rendering are timed.
+#
+#   python benchmarks/bench_llm_registry.py [iterations]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from langchain_openai import ChatOpenAI
+from langchain.chains import LLMChain
+from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+
+from mailgen_llm import get_chain
+
+SYSTEM_TEMPLATE = "You are a professional translator specializing in translating from {source_language} to {target_language}."
+HUMAN_TEMPLATE = """
+    Translate the following text:
+
+    {email_content}
+    """
+INPUTS = {"email_content": "Beste, graag mijn domiciliëring stopzetten.", "source_language": "nl", "target_language": "French"}
+
+
+def per_call_construction():
+    prompt = ChatPromptTemplate.from_messages([
+        SystemMessagePromptTemplate.from_template(SYSTEM_TEMPLATE),
+        HumanMessagePromptTemplate.from_template(HUMAN_TEMPLATE)
+    ])
+    llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.3)
+    chain = LLMChain(llm=llm, prompt=prompt)
+    return chain.prompt.format_messages(**INPUTS)
+
+
+def registry_lookup():
+    chain = get_chain("translate_email", "gpt-4o-mini", SYSTEM_TEMPLATE, HUMAN_TEMPLATE)
+    return chain.prompt.format_messages(**INPUTS)
+
+
+def timed(fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    before = timed(per_call_construction, iterations)
+    after = timed(registry_lookup, iterations)
+    print(f"per-call construction: {before:.3f} ms/call")
+    print(f"chain registry:        {after:.3f} ms/call")
+    print(f"speed-up:              {before / after:.1f}x")
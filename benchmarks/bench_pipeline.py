@@ -0,0 +1,205 @@
+# End-to-end benchmark of the reply pipeline against the local fake OpenAI server,
+# so it runs offline and for free (e.g. in CI).
+#
+#   python benchmarks/bench_pipeline.py                      # batch + UI paths
+#   python benchmarks/bench_pipeline.py --paths batch --workers 8 --json results.json
+#
+# The "batch" path runs every corpus email through mailgen_batch.process_record.
+# The "ui" path drives DBox_mailgen.main() with Streamlit's AppTest: paste the
+# email, fill in the donor fields and click "Generate Response".
+# The response store is disabled so every run measures real pipeline work.
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai import FakeOpenAIServer
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus.jsonl")
+STAGES = ("detect_demands,select_relevant_responses,draft_initial_response,refine_response,"
+          "select_and_draft_response,compose_response,repair_response,translate_email")
+
+
+def configure_environment(base_url):
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_BASE"] = base_url
+    os.environ["MAILGEN_CACHE_BACKEND"] = "memory"
+    os.environ["MAILGEN_CACHE_DISABLED_STAGES"] = STAGES
+    # Nothing served from the translation memory, and no SQLite files left in the checkout
+    os.environ["MAILGEN_TRANSLATION_MEMORY"] = "0"
+    scratch = tempfile.mkdtemp(prefix="mailgen-bench-")
+    os.environ["MAILGEN_TM_PATH"] = os.path.join(scratch, "tm.sqlite")
+    os.environ["MAILGEN_DEDUP_PATH"] = os.path.join(scratch, "dedup.sqlite")
+    os.environ.pop("MAILGEN_METRICS_PATH", None)
+    os.environ.pop("MAILGEN_METRICS_PORT", None)
+
+
+def load_corpus(path=CORPUS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_batch_path(records, workers):
+    import mailgen_agents
+    from mailgen_batch import process_record
+
+    defaults = argparse.Namespace(donor_type="Other", name="", actions="")
+    mailgen_agents.get_demands_cache().clear()
+
+    def timed(record):
+        start = time.perf_counter()
+        process_record(record, defaults, 0.3)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = list(pool.map(timed, records))
+    return latencies, time.perf_counter() - start
+
+
+# Held around every script run; the load test makes it a lock (see load_test.py)
+SCRIPT_RUNS = contextlib.nullcontext()
+
+
+def run_script(at):
+    with SCRIPT_RUNS:
+        at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+
+def _by_label(widgets, label):
+    return next(widget for widget in widgets if widget.label == label)
+
+
+def generating(at):
+    return "generation_job" in at.session_state and at.session_state["generation_job"] is not None
+
+
+def wait_for_button(at, label, timeout=300):
+    # Generation runs as a background job; rerun the script until it is finished and the
+    # button shows up (in a session that answered an email before, it is already there)
+    deadline = time.monotonic() + timeout
+    while True:
+        button = next((widget for widget in at.button if widget.label == label), None)
+        if (button is not None and not generating(at)) or time.monotonic() > deadline:
+            return button or _by_label(at.button, label)
+        time.sleep(0.05)
+        run_script(at)
+
+
+def open_session():
+    # A fresh browser session on the app, logged in
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, "DBox_mailgen.py"), default_timeout=300)
+    at.secrets["OPENAI_API_KEY"] = "sk-fake"
+    at.secrets["MDM_PASSWORD"] = "benchmark"
+    run_script(at)
+    at.sidebar.text_input[0].input("benchmark")
+    run_script(at)
+    return at
+
+
+def answer_email(at, record):
+    # What an agent does for one email: paste, fill in the donor fields, generate, translate
+    # Every widget change is its own script run, as in a browser
+    _by_label(at.text_area, "Paste the incoming email here:").input(record["email"])
+    run_script(at)
+    _by_label(at.text_area, "Specify actions undertaken (eg stop sdd):").input(record.get("actions", ""))
+    run_script(at)
+    _by_label(at.radio, "**Select donor type:**").set_value(record["donor_info"]["type"])
+    run_script(at)
+    _by_label(at.text_input, "Your Name:").input(record.get("name", ""))
+    run_script(at)
+    _by_label(at.button, "Generate Response").click()
+    run_script(at)
+    wait_for_button(at, "Translate the generated email").click()
+    run_script(at)
+
+
+def run_ui_path(records):
+    import mailgen_agents
+
+    latencies = []
+    start = time.perf_counter()
+    for record in records:
+        mailgen_agents.get_demands_cache().clear()
+        at = open_session()
+        email_start = time.perf_counter()
+        answer_email(at, record)
+        latencies.append(time.perf_counter() - email_start)
+    return latencies, time.perf_counter() - start
+
+
+def report(path, latencies, wall, requests):
+    from mailgen_metrics import metrics, percentile
+
+    stages = metrics.summary()
+    result = {
+        "path": path,
+        "emails": len(latencies),
+        "wall_seconds": round(wall, 3),
+        "throughput_per_minute": round(len(latencies) / wall * 60, 2) if wall else 0.0,
+        "latency_p50": round(percentile(latencies, 0.5), 3),
+        "latency_p95": round(percentile(latencies, 0.95), 3),
+        "llm_requests": requests,
+        "prompt_tokens": sum(stage["prompt_tokens"] for stage in stages),
+        "completion_tokens": sum(stage["completion_tokens"] for stage in stages),
+        "cached_tokens": sum(stage["cached_tokens"] for stage in stages),
+        "stages": stages,
+    }
+    print(f"\n== {path} path: {result['emails']} emails in {result['wall_seconds']}s "
+          f"({result['throughput_per_minute']}/min), e2e p50 {result['latency_p50']}s p95 {result['latency_p95']}s, "
+          f"{result['llm_requests']} requests, {result['prompt_tokens']} prompt tokens ({result['cached_tokens']} cached)")
+    for stage in stages:
+        print(f"   {stage['stage']:<28} calls {stage['calls']:>4}  p50 {stage['p50']:.3f}s  p95 {stage['p95']:.3f}s  "
+              f"prompt tokens {stage['prompt_tokens']:>7} (cached {stage['cached_tokens']:>7})")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark against a fake OpenAI server")
+    parser.add_argument("--paths", default="batch,ui", help="comma-separated: batch, ui")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent emails on the batch path")
+    parser.add_argument("--repeat", type=int, default=1, help="run the corpus this many times")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake server seconds before first token")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="fake server seconds per token")
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    server = FakeOpenAIServer(0, args.latency, args.token_delay, args.completion_tokens).start()
+    configure_environment(server.base_url)
+    from mailgen_metrics import metrics
+
+    records = load_corpus() * args.repeat
+    results = []
+    for path in args.paths.split(","):
+        metrics.reset()
+        requests_before = server.requests
+        if path == "batch":
+            latencies, wall = run_batch_path(records, args.workers)
+        elif path == "ui":
+            latencies, wall = run_ui_path(records)
+        else:
+            parser.error(f"unknown path {path!r}")
+        results.append(report(path, latencies, wall, server.requests - requests_before))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
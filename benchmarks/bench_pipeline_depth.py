@@ -0,0 +1,115 @@
+# Side-by-side comparison of the pipeline depths behind "Generate Response":
+# 3 calls (select, draft, refine), 2 calls (select+draft, refine) and 1 call.
+# Reports latency, LLM requests, tokens, cost and how often the replies follow
+# the rules the prompts insist on.
+#
+#   python benchmarks/bench_pipeline_depth.py                     # offline, fake OpenAI server
+#   python benchmarks/bench_pipeline_depth.py --real --repeat 3   # real API (OPENAI_API_KEY, costs money)
+#
+# Against the fake server the replies are canned, so only latency and token
+# numbers mean something there; rule compliance needs --real.
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_pipeline import ROOT, configure_environment, load_corpus
+from fake_openai import FakeOpenAIServer
+
+sys.path.insert(0, ROOT)
+
+from mailgen_validate import NO_PAYMENT_MARKER, WEBSITES, check_reply
+
+
+def compliance(response, record, organization):
+    # rule -> passed, for the rules the app enforces (mailgen_validate) that apply to this record
+    name = record.get("name", "")
+    broken = {rule for rule, _ in check_reply(response, record["donor_info"], name, organization)}
+    rules = ["placeholder", "organization in signature"]
+    if name:
+        rules.append("name in signature")
+    if organization in WEBSITES:
+        rules.append("website")
+    if NO_PAYMENT_MARKER in record["donor_info"].get("gift_history_info", ""):
+        rules.append("no further payments")
+    return {rule: rule not in broken for rule in rules}
+
+
+def run_depth(depth, prepared, temperature):
+    from mailgen_agents import generate_reply
+    from mailgen_metrics import llm_calls, metrics, percentile
+
+    metrics.reset()
+    latencies = []
+    passed = {}
+    for record, email_content, language, organization, demands in prepared:
+        start = time.perf_counter()
+        response = generate_reply(demands, email_content, record["donor_info"], record.get("actions", ""), "", "",
+                                  language, record.get("name", ""), organization, temperature, use_cache=False, depth=depth)
+        latencies.append(time.perf_counter() - start)
+        for rule, ok in compliance(response, record, organization).items():
+            passed.setdefault(rule, []).append(ok)
+
+    stages = metrics.summary()
+    return {
+        "depth": depth,
+        "emails": len(latencies),
+        "latency_p50": round(percentile(latencies, 0.5), 3),
+        "latency_p95": round(percentile(latencies, 0.95), 3),
+        "llm_calls": llm_calls(stages),
+        "prompt_tokens": sum(stage["prompt_tokens"] for stage in stages),
+        "completion_tokens": sum(stage["completion_tokens"] for stage in stages),
+        "cost": round(sum(stage["cost"] for stage in stages), 4),
+        "compliance": {rule: round(sum(results) / len(results), 3) for rule, results in passed.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare pipeline depths on latency, tokens and rule compliance")
+    parser.add_argument("--depths", default="3,2,1", help="comma-separated pipeline depths")
+    parser.add_argument("--repeat", type=int, default=1, help="run the corpus this many times")
+    parser.add_argument("--temperature", type=float, default=0.3)
+    parser.add_argument("--real", action="store_true", help="call the real OpenAI API instead of the fake server")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake server seconds before first token")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="fake server seconds per token")
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    server = None
+    if not args.real:
+        server = FakeOpenAIServer(0, args.latency, args.token_delay, args.completion_tokens).start()
+        configure_environment(server.base_url)
+    from mailgen_agents import get_demands, organization_for
+    from mailgen_language import detect_language
+    from mailgen_preprocess import clean_email
+
+    # Demand detection is the same for every depth: do it once, outside the timings
+    prepared = []
+    for record in load_corpus() * args.repeat:
+        email_content = clean_email(record["email"]).text
+        language = record.get("language") or detect_language(email_content).language
+        prepared.append((record, email_content, language, organization_for(language), get_demands(email_content)))
+
+    results = [run_depth(int(depth), prepared, args.temperature) for depth in args.depths.split(",")]
+
+    print(f"\n{'depth':>5} {'p50 s':>8} {'p95 s':>8} {'calls':>6} {'prompt tok':>11} {'compl. tok':>11} {'cost $':>8}")
+    for result in results:
+        print(f"{result['depth']:>5} {result['latency_p50']:>8.3f} {result['latency_p95']:>8.3f} {result['llm_calls']:>6} "
+              f"{result['prompt_tokens']:>11} {result['completion_tokens']:>11} {result['cost']:>8.4f}")
+    print("\nrule compliance (share of replies passing):")
+    for rule in results[0]["compliance"]:
+        print(f"   {rule:<28} " + "  ".join(f"depth {result['depth']}: {result['compliance'].get(rule, 0.0):.0%}" for result in results))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Cold start of the app, measured in fresh processes: importing streamlit, the
+# app's own imports, time until the password prompt is rendered, the background
+# warm-up (heavy libraries, LLM clients, language profiles) and the first login.
+#
+#   python benchmarks/bench_startup.py --repeat 5
+#   python benchmarks/bench_startup.py --no-warmup     # MAILGEN_WARMUP=0, for comparison
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_pipeline import ROOT, configure_environment
+
+
+def measure():
+    # One cold start, in this (fresh) process
+    start = time.perf_counter()
+    import streamlit
+    from streamlit.testing.v1 import AppTest
+    streamlit_import = time.perf_counter() - start
+
+    at = AppTest.from_file(os.path.join(ROOT, "DBox_mailgen.py"), default_timeout=300)
+    at.secrets["OPENAI_API_KEY"] = "sk-fake"
+    at.secrets["MDM_PASSWORD"] = "benchmark"
+    start = time.perf_counter()
+    at.run()
+    first_render = time.perf_counter() - start
+
+    # The agent typing the password: everything after it runs on whatever the warm-up got to
+    start = time.perf_counter()
+    at.sidebar.text_input[0].input("benchmark").run()
+    login = time.perf_counter() - start
+
+    from mailgen_warmup import startup_stats, wait_for_warmup
+
+    wait_for_warmup(60)
+    stats = startup_stats()
+    return {"streamlit_import": round(streamlit_import, 4), "app_import": stats.get("import", 0.0),
+            "first_render": round(first_render, 4), "login": round(login, 4), "warmup": stats.get("warmup", 0.0),
+            "warmup_steps": stats["warmup_steps"], "warmup_errors": stats["warmup_errors"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the app's cold start in fresh processes")
+    parser.add_argument("--repeat", type=int, default=3, help="number of cold starts")
+    parser.add_argument("--no-warmup", action="store_true", help="turn the background warm-up off (MAILGEN_WARMUP=0)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    configure_environment("http://127.0.0.1:9/v1")
+    if args.child:
+        print(json.dumps(measure()))
+        return
+
+    env = dict(os.environ, MAILGEN_WARMUP="0" if args.no_warmup else "1")
+    runs = []
+    for _ in range(args.repeat):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"], env=env, cwd=ROOT,
+                                check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'phase':<20} {'median s':>9} {'max s':>8}")
+    for phase in ("streamlit_import", "app_import", "first_render", "login", "warmup"):
+        values = [run[phase] for run in runs]
+        print(f"{phase:<20} {statistics.median(values):>9.3f} {max(values):>8.3f}")
+    for step in runs[0]["warmup_steps"]:
+        values = [run["warmup_steps"].get(step, 0.0) for run in runs]
+        print(f"  warm-up: {step:<18} {statistics.median(values):>9.3f} {max(values):>8.3f}")
+    for step, error in runs[-1]["warmup_errors"].items():
+        print(f"  warm-up {step} failed: {error}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(runs, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
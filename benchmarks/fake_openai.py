@@ -0,0 +1,161 @@
+# Local stand-in for the OpenAI chat-completions endpoint, for benchmarks that
+# must not touch the network or cost money.
+#
+#   python benchmarks/fake_openai.py --port 8765 --latency 0.5 --token-delay 0.01
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=sk-fake streamlit run DBox_mailgen.py
+import argparse
+import json
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY_TEXT = (
+    "Beste [name],\n\nBedankt voor uw e-mail. Zoals gevraagd hebben we uw domiciliëring stopgezet, "
+    "er zullen geen automatische betalingen meer gebeuren. Wij danken u voor uw steun aan de meest "
+    "kwetsbaren. Heeft u nog vragen, dan helpen we u graag verder.\n\nMet vriendelijke groeten,\n"
+    "Alexis\nDokters van de Wereld\n"
+)
+DEMANDS_TEXT = "donation cancellation, unsubscribe"
+
+
+def count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def completion_text(messages, completion_tokens):
+    prompt = " ".join(str(message.get("content", "")) for message in messages)
+    if "Detected demands (comma-separated list)" in prompt:
+        return DEMANDS_TEXT
+    words = REPLY_TEXT.split(" ")
+    text = []
+    while count_tokens(" ".join(text)) < completion_tokens:
+        text.append(words[len(text) % len(words)])
+    return " ".join(text)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        config = self.server.config
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        with self.server.lock:
+            self.server.requests += 1
+        messages = body.get("messages", [])
+        prompt_tokens = sum(count_tokens(str(message.get("content", ""))) for message in messages)
+        cached_tokens = self.server.cached_prefix_tokens(messages)
+        n = body.get("n") or 1
+        text = completion_text(messages, config.completion_tokens)
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            # Fused pipeline stages ask for {"relevant_parts": ..., "draft" or "response": ...}
+            text = json.dumps({"relevant_parts": "", "draft": text, "response": text}, ensure_ascii=False)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": count_tokens(text) * n,
+                 "total_tokens": prompt_tokens + count_tokens(text) * n,
+                 "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        created = int(time.time())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        time.sleep(config.latency)
+
+        if not body.get("stream"):
+            payload = json.dumps({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": body.get("model"),
+                "choices": [{"index": i, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+                            for i in range(n)],
+                "usage": usage,
+            }).encode("utf-8")
+            time.sleep(config.token_delay * count_tokens(text))
+            self.send_response(200)
+            self._rate_limit_headers()
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self._rate_limit_headers()
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        words = text.split(" ")
+        for i in range(n):
+            for j, word in enumerate(words):
+                piece = word if j == 0 else " " + word
+                self._event({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                             "model": body.get("model"),
+                             "choices": [{"index": i, "delta": {"content": piece}, "finish_reason": None}]})
+                time.sleep(config.token_delay)
+            self._event({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                         "model": body.get("model"), "choices": [{"index": i, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._event({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                         "model": body.get("model"), "choices": [], "usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _event(self, data):
+        self.wfile.write(b"data: " + json.dumps(data).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+    def _rate_limit_headers(self):
+        self.send_header("x-ratelimit-limit-requests", "10000")
+        self.send_header("x-ratelimit-remaining-requests", "9999")
+        self.send_header("x-ratelimit-limit-tokens", "10000000")
+        self.send_header("x-ratelimit-remaining-tokens", "9999000")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.2, token_delay=0.005, completion_tokens=200):
+        super().__init__(("127.0.0.1", port), FakeOpenAIHandler)
+        self.config = argparse.Namespace(latency=latency, token_delay=token_delay, completion_tokens=completion_tokens)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prefixes = set()
+
+    def handle_error(self, request, client_address):
+        # A client that stops reading a stream (a cancelled translation prefetch) is not an error
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def cached_prefix_tokens(self, messages):
+        # Like OpenAI's prompt caching: a system message of 1024+ tokens seen
+        # before is served from cache, in 128-token increments
+        if not messages or messages[0].get("role") != "system":
+            return 0
+        content = str(messages[0].get("content", ""))
+        tokens = count_tokens(content)
+        with self.lock:
+            seen = content in self.prefixes
+            self.prefixes.add(content)
+        return tokens // 128 * 128 if seen and tokens >= 1024 else 0
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-openai", daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat-completions server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="seconds per generated token")
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    args = parser.parse_args()
+    server = FakeOpenAIServer(args.port, args.latency, args.token_delay, args.completion_tokens)
+    print(f"Fake OpenAI API on {server.base_url}")
+    server.serve_forever()
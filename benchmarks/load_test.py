@@ -0,0 +1,143 @@
+# How many agents can one Streamlit process serve? Drives N concurrent sessions
+# through DBox_mailgen.main() with Streamlit's AppTest against the local fake
+# OpenAI server, for increasing N, and reports throughput, per-email latency,
+# memory growth and thread usage. Useful to size dynos and to catch scaling
+# regressions.
+#
+#   python benchmarks/load_test.py --sessions 1,2,4,8,16 --emails 4
+#   python benchmarks/load_test.py --sessions 8 --latency 1.0 --json load.json
+import argparse
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bench_pipeline
+from bench_pipeline import answer_email, configure_environment, load_corpus, open_session
+from fake_openai import FakeOpenAIServer
+
+
+def rss_mb():
+    # Current resident set size; peak RSS where /proc isn't available
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class ThreadSampler:
+    # Peak number of live threads while the load runs
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="thread-sampler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, threading.active_count())
+            self._stop.wait(self.interval)
+
+
+def run_session(session, records):
+    # Every email gets a per-session reference line, so sessions don't share
+    # cached demands and each email is real work for the pipeline
+    at = open_session()
+    latencies = []
+    for i, record in enumerate(records):
+        record = dict(record, email=f"{record['email']}\n\nReferentie {session}-{i}")
+        start = time.perf_counter()
+        answer_email(at, record)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_level(sessions, records):
+    from mailgen_metrics import llm_calls, metrics, percentile
+
+    metrics.reset()
+    rss_before = rss_mb()
+    threads_before = threading.active_count()
+    start = time.perf_counter()
+    with ThreadSampler() as sampler, ThreadPoolExecutor(max_workers=sessions) as pool:
+        per_session = list(pool.map(lambda session: run_session(session, records), range(sessions)))
+    wall = time.perf_counter() - start
+    latencies = [latency for session in per_session for latency in session]
+    session_p95 = [percentile(session, 0.95) for session in per_session]
+    return {
+        "sessions": sessions,
+        "emails": len(latencies),
+        "wall_seconds": round(wall, 3),
+        "throughput_per_minute": round(len(latencies) / wall * 60, 2) if wall else 0.0,
+        "latency_p50": round(percentile(latencies, 0.5), 3),
+        "latency_p95": round(percentile(latencies, 0.95), 3),
+        "worst_session_p95": round(max(session_p95), 3),
+        "rss_mb_before": round(rss_before, 1),
+        "rss_mb_after": round(rss_mb(), 1),
+        "rss_mb_growth": round(rss_mb() - rss_before, 1),
+        "threads_before": threads_before,
+        "threads_peak": sampler.peak,
+        "threads_after": threading.active_count(),
+        "llm_calls": llm_calls(metrics.summary()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-session load test of the Streamlit app against a fake OpenAI server")
+    parser.add_argument("--sessions", default="1,2,4,8", help="comma-separated numbers of concurrent sessions")
+    parser.add_argument("--emails", type=int, default=4, help="emails answered per session")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake server seconds before first token")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="fake server seconds per token")
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    server = FakeOpenAIServer(0, args.latency, args.token_delay, args.completion_tokens).start()
+    configure_environment(server.base_url)
+    # AppTest is made for one test at a time: every script run installs process-wide state
+    # (a mock Runtime, config overrides, st.secrets) and removes it when it ends, under the
+    # feet of a run in another thread. Script runs take turns; the work they start (jobs,
+    # stage graphs, LLM calls) still overlaps across sessions. A script run that waits on
+    # the demands holds the others up, so latencies above 1 session are slightly pessimistic
+    bench_pipeline.SCRIPT_RUNS = threading.Lock()
+    corpus = load_corpus()
+    records = [corpus[i % len(corpus)] for i in range(args.emails)]
+
+    results = []
+    print(f"{'sessions':>8} {'emails':>6} {'per min':>8} {'p50 s':>7} {'p95 s':>7} {'worst s p95':>11} "
+          f"{'RSS MB':>8} {'growth':>7} {'threads':>7} {'peak':>5} {'after':>5}")
+    for sessions in (int(n) for n in args.sessions.split(",")):
+        result = run_level(sessions, records)
+        results.append(result)
+        print(f"{result['sessions']:>8} {result['emails']:>6} {result['throughput_per_minute']:>8.1f} "
+              f"{result['latency_p50']:>7.2f} {result['latency_p95']:>7.2f} {result['worst_session_p95']:>11.2f} "
+              f"{result['rss_mb_after']:>8.1f} {result['rss_mb_growth']:>+7.1f} {result['threads_before']:>7} "
+              f"{result['threads_peak']:>5} {result['threads_after']:>5}", flush=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
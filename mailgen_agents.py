@@ -0,0 +1,322 @@
+import json
+import os
+import re
+import time
+
+from mailgen_cache import LRUCache, content_key, normalize_text, reuse_artifact
+from mailgen_classifier import get_classifier
+from mailgen_examples import format_examples, get_example_index
+from mailgen_library import get_library
+from mailgen_llm import get_chain
+from mailgen_metrics import metrics
+from mailgen_router import as_labels, get_router
+from mailgen_store import cached_run, cached_run_many, cached_stream
+from mailgen_translation import TRANSLATION_MEMORY, get_translation_memory, translate_with_memory
+from mailgen_validate import VALIDATE_REPLIES, check_reply, fix_locally, get_validator, unresolved_placeholders
+
+# Number of LLM calls behind "Generate Response": 3 = select, draft and refine;
+# 2 = selection and draft in one call, then refine; 1 = everything in one call
+PIPELINE_DEPTH = int(os.environ.get("MAILGEN_PIPELINE_DEPTH", "3"))
+PIPELINE_DEPTHS = (3, 2, 1)
+
+# Demands only depend on the email, so keep them across reruns and sessions
+demands_cache = LRUCache(maxsize=1000, ttl=24 * 3600)
+
+def get_demands_cache():
+    return demands_cache
+
+# Prompts put everything that is the same for every email (role, instructions,
+# guidelines, examples) in the system message and the email's own data last, so
+# the provider can serve the long shared prefix from its prompt cache.
+# By default ("retrieved") only the examples closest to the demands are sent, in
+# corpus order so the same demand mix gets the same prefix; "corpus" puts the whole
+# example corpus in the prefix instead (more tokens, one prefix for every email)
+PROMPT_EXAMPLES = os.environ.get("MAILGEN_PROMPT_EXAMPLES", "retrieved")
+
+def examples_for_prompt(examples, demands, email_content):
+    if PROMPT_EXAMPLES == "corpus":
+        return examples.strip()
+    index = get_example_index(get_library().examples())
+    # Corpus order, so emails with the same demands get the same prompt prefix
+    records = sorted(index.search(demands, email_content), key=index.records.index)
+    return format_examples(records)
+
+def reply_problem(text, name):
+    # Cheap checks of a generated reply; a problem sends the call one model up the ladder.
+    # A larger model can't invent the agent's name, so [Your Name] only counts when there is one
+    if not text.strip():
+        return "empty answer"
+    if unresolved_placeholders(text, name):
+        return "unresolved placeholder"
+    return None
+
+def json_problem(answer, field, name):
+    parsed = parse_json_answer(answer)
+    if not isinstance(parsed, dict) or not isinstance(parsed.get(field), str):
+        return "answer is not the requested JSON"
+    return reply_problem(parsed[field], name)
+
+def routed_run(stage, system_template, human_template, temperature, use_cache, route_demands=None, route_text="", validate=None, json_output=False, **inputs):
+    # The router picks the model from the demands and email; an answer failing validate() is retried one model up
+    router = get_router()
+    model = router.choose(stage, route_demands, route_text)
+    while True:
+        chain = get_chain(stage, model, system_template, human_template, json_output)
+        answer = cached_run(stage, chain, temperature, use_cache, **inputs)
+        problem = validate(answer) if validate else None
+        larger = router.escalate(stage, model, problem) if problem else None
+        if larger is None:
+            return answer
+        model = larger
+
+def routed_stream(stage, system_template, human_template, temperature, use_cache, route_demands=None, route_text="", **inputs):
+    # Streamed text is already on screen, so streams are routed but not escalated
+    chain = get_chain(stage, get_router().choose(stage, route_demands, route_text), system_template, human_template)
+    return cached_stream(stage, chain, temperature, use_cache, **inputs)
+
+# AI agent functions
+def detect_demands(email_content, use_cache=True):
+    # An answer naming none of the known demand types is a low-confidence answer
+    template = get_library().template("detect_demands")
+    answer = routed_run("detect_demands", template.system, template.human, 0.5, use_cache, route_text=email_content,
+                        validate=lambda answer: None if as_labels(answer) else "no known demand type", email_content=email_content)
+    demands = answer.strip().split(', ')
+    return demands
+
+def classify_or_detect_demands(email_content):
+    # Obvious cancellations, tax certificate questions etc. are answered locally
+    start = time.perf_counter()
+    labels, confident = get_classifier().classify(email_content)
+    metrics.record("classify_demands", "local-classifier", time.perf_counter() - start, fast_path=int(confident))
+    if confident:
+        return labels
+    return detect_demands(email_content)
+
+def get_demands(email_content):
+    key = content_key(normalize_text(email_content), get_router().version, get_library().template("detect_demands").version, get_classifier().version)
+    return get_demands_cache().get_or_compute(key, lambda: classify_or_detect_demands(email_content))
+
+def select_relevant_responses(demands, examples, email_content, donor_info, actions, additional_messages, additional_guidelines, use_cache=True):
+    template = get_library().template("select_relevant_responses")
+    relevant_responses = routed_run("select_relevant_responses", template.system, template.human, 0.5, use_cache, demands, email_content,
+                                    email_content=email_content, demands=demands, donor_info=donor_info, 
+                                   actions=actions, additional_messages=additional_messages, examples=examples_for_prompt(examples, demands, email_content),
+                                   additional_guidelines=additional_guidelines)
+    return relevant_responses
+
+
+def draft_initial_response(email_content, actions, additional_messages, additional_guidelines, donor_info, relevant_responses, language, name, organization, use_cache=True, stream=False, demands=None):
+    template = get_library().template("draft_initial_response")
+    inputs = dict(email_content=email_content, actions=actions, additional_messages=additional_messages, donor_info=donor_info, relevant_responses=relevant_responses,
+                  language=language, name=name, organization=organization, additional_guidelines=additional_guidelines)
+    if stream:
+        return routed_stream("draft_initial_response", template.system, template.human, 0.5, use_cache, demands, email_content, **inputs)
+    return routed_run("draft_initial_response", template.system, template.human, 0.5, use_cache, demands, email_content, validate=lambda answer: reply_problem(answer, name), **inputs)
+
+
+# Candidates are meant to differ, so they are sampled at least this warm
+CANDIDATE_MIN_TEMPERATURE = float(os.environ.get("MAILGEN_CANDIDATE_MIN_TEMPERATURE", "0.7"))
+MAX_CANDIDATES = 4
+
+def refine_response(draft_response, donor_info, language, name, organization, temperature, use_cache=True, stream=False):
+    template = get_library().template("refine_response")
+    inputs = dict(draft_response=draft_response, donor_info=donor_info, language=language, name=name, organization=organization)
+    if stream:
+        return routed_stream("refine_response", template.system, template.human, temperature, use_cache, **inputs)
+    return routed_run("refine_response", template.system, template.human, temperature, use_cache, validate=lambda answer: reply_problem(answer, name), **inputs)
+
+def refine_candidates(draft_response, donor_info, language, name, organization, temperature, n, use_cache=True):
+    # n refinements of the same draft in one request, for the agent to pick from, instead of
+    # rerunning select/draft/refine until one fits. Candidates failing reply_problem are dropped;
+    # if none is left the request is repeated one model up the ladder
+    template = get_library().template("refine_response")
+    inputs = dict(draft_response=draft_response, donor_info=donor_info, language=language, name=name, organization=organization)
+    temperature = max(temperature, CANDIDATE_MIN_TEMPERATURE)
+    router = get_router()
+    model = router.choose("refine_response")
+    while True:
+        chain = get_chain("refine_response", model, template.system, template.human)
+        answers = cached_run_many("refine_response", chain, temperature, n, use_cache, **inputs)
+        candidates = list(dict.fromkeys(answer for answer in answers if not reply_problem(answer, name)))
+        larger = None if candidates else router.escalate("refine_response", model, reply_problem(answers[0], name))
+        if larger is None:
+            return candidates or answers[:1]
+        model = larger
+
+def check_and_repair(reply, donor_info, language, name, organization, use_cache=True):
+    # Local rule check of a finished reply (mailgen_validate). Only what the rules
+    # flag goes back to the LLM, as one small repair call escalated while it still fails
+    if not VALIDATE_REPLIES:
+        return reply
+    validator = get_validator()
+    start = time.perf_counter()
+    fixed, problems = validator.validate(reply, donor_info, name, organization)
+    metrics.record("validate_reply", "local-validator", time.perf_counter() - start, passed=int(not problems and fixed == reply),
+                   fixed_locally=int(not problems and fixed != reply), repair_calls=int(bool(problems)))
+    if not problems:
+        return fixed
+
+    def remaining_problem(answer):
+        problem = reply_problem(answer, name)
+        if problem is not None:
+            return problem
+        remaining = check_reply(answer, donor_info, name, organization)
+        return remaining[0][0] if remaining else None
+
+    template = get_library().template("repair_response")
+    repaired = routed_run("repair_response", template.system, template.human, 0.0, use_cache, validate=remaining_problem,
+                          reply=fixed, language=language, problems="\n".join(f"- {instruction}" for _, instruction in problems))
+    validator.record_repair(remaining_problem(repaired) is None)
+    return fixed if reply_problem(repaired, name) else repaired
+
+def candidate_problems(reply, donor_info, name, organization):
+    # Names of the rules a reply still breaks, [] when replies aren't checked
+    if not VALIDATE_REPLIES:
+        return []
+    return [rule for rule, _ in check_reply(reply, donor_info, name, organization)]
+
+def parse_json_answer(answer):
+    # Models sometimes wrap JSON in a code fence; None when it still doesn't parse
+    answer = re.sub(r"^```(json)?|```$", "", answer.strip()).strip()
+    try:
+        return json.loads(answer)
+    except ValueError:
+        return None
+
+def select_and_draft_response(demands, examples, email_content, donor_info, actions, additional_messages, additional_guidelines, language, name, organization, use_cache=True):
+    # Pipeline depth 2: selection and first draft in one call. Returns (relevant_responses, draft)
+    template = get_library().template("select_and_draft_response")
+    answer = routed_run("select_and_draft_response", template.system, template.human, 0.5, use_cache, demands, email_content,
+                        validate=lambda answer: json_problem(answer, "draft", name), json_output=True, email_content=email_content, demands=demands, donor_info=donor_info,
+                        actions=actions, additional_messages=additional_messages, additional_guidelines=additional_guidelines,
+                        examples=examples_for_prompt(examples, demands, email_content), language=language, name=name, organization=organization)
+    parsed = parse_json_answer(answer)
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("draft"), str):
+        return "", answer
+    return str(parsed.get("relevant_parts", "")), parsed["draft"]
+
+def compose_response(demands, examples, email_content, donor_info, actions, additional_messages, additional_guidelines, language, name, organization, temperature, use_cache=True):
+    # Pipeline depth 1: selection, drafting and refinement in a single call
+    template = get_library().template("compose_response")
+    answer = routed_run("compose_response", template.system, template.human, temperature, use_cache, demands, email_content,
+                        validate=lambda answer: json_problem(answer, "response", name), json_output=True, email_content=email_content, demands=demands, donor_info=donor_info,
+                        actions=actions, additional_messages=additional_messages, additional_guidelines=additional_guidelines,
+                        examples=examples_for_prompt(examples, demands, email_content), language=language, name=name, organization=organization)
+    parsed = parse_json_answer(answer)
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("response"), str):
+        return answer
+    return parsed["response"]
+
+def translate_email(email_content, source_language, target_language, use_cache=True, memory=False):
+    # With memory (our own replies), sentences seen before come from the translation memory and
+    # only new ones go to the LLM. Donor emails are translated whole: their sentences are
+    # personal and rarely repeat, and they don't belong in a store shared by every session
+    if memory and TRANSLATION_MEMORY and use_cache:
+        translated = translate_with_memory(get_translation_memory(), email_content, source_language, target_language,
+                                           lambda sentences: translate_sentences(sentences, source_language, target_language))
+        if translated is not None:
+            return translated
+    return translate_whole_email(email_content, source_language, target_language, use_cache)
+
+def translate_sentences(sentences, source_language, target_language):
+    template = get_library().template("translate_sentences")
+    chain = get_chain("translate_email", get_router().choose("translate_email", email_content=" ".join(sentences)), template.system, template.human)
+    
+    answer = cached_run("translate_email", chain, 0.3, segments=json.dumps(sentences, ensure_ascii=False),
+                        source_language=source_language, target_language=target_language)
+    translations = parse_json_answer(answer)
+    if not isinstance(translations, list) or not all(isinstance(t, str) for t in translations):
+        return None
+    return translations
+
+def translate_whole_email(email_content, source_language, target_language, use_cache=True):
+    template = get_library().template("translate_email")
+    chain = get_chain("translate_email", get_router().choose("translate_email", email_content=email_content), template.system, template.human)
+    
+    return cached_run("translate_email", chain, 0.3, use_cache, email_content=email_content,
+                      source_language=source_language, target_language=target_language)
+
+def organization_for(language):
+    return "Dokters van de Wereld" if language == "nl" else "Médecins du Monde"
+
+def target_language_for(language):
+    return "Dutch" if language == "fr" else "French"
+
+def generate_reply(demands, email_content, donor_info, actions, additional_messages, additional_guidelines, language, name, organization, temperature, use_cache=True, depth=None):
+    # select -> draft -> refine, as run by the "Generate Response" button, in as many calls as the pipeline depth
+    depth = depth or PIPELINE_DEPTH
+    examples = get_library().examples_text()
+    if depth == 1:
+        response = compose_response(demands, examples, email_content, donor_info, actions, additional_messages, additional_guidelines, language, name, organization, temperature, use_cache=use_cache)
+        return check_and_repair(response, donor_info, language, name, organization, use_cache=use_cache)
+    if depth == 2:
+        _, initial_draft = select_and_draft_response(demands, examples, email_content, donor_info, actions, additional_messages, additional_guidelines, language, name, organization, use_cache=use_cache)
+    else:
+        relevant_responses = select_relevant_responses(demands, examples, email_content, donor_info, actions, additional_messages, additional_guidelines, use_cache=use_cache)
+        initial_draft = draft_initial_response(email_content, actions, additional_messages, additional_guidelines, donor_info, relevant_responses, language, name, organization, use_cache=use_cache, demands=demands)
+    response = refine_response(initial_draft, donor_info, language, name, organization, temperature, use_cache=use_cache)
+    return check_and_repair(response, donor_info, language, name, organization, use_cache=use_cache)
+
+def run_reply_job(job, artifacts, demands, email_content, donor_info, actions, additional_messages, additional_guidelines, language, name, organization, temperature, depth, stream=True, use_cache=True, candidates=1):
+    # The "Generate Response" pipeline as a background job (mailgen_jobs): progress and streamed text
+    # go to job, and stages whose inputs are unchanged since the session's last run come from artifacts
+    # (a copy of the session's, returned updated with the result). candidates > 1 asks the refinement
+    # for that many alternatives (depths 2 and 3), returned under "candidates" for the agent to pick from
+    # An edited example or prompt in the library invalidates the stages that use it
+    library = get_library()
+    examples = library.examples_text()
+    donor_key = json.dumps(donor_info, sort_keys=True)
+    select_inputs = (demands, email_content, donor_key, actions, additional_messages, additional_guidelines, library.examples_version)
+
+    def version(name):
+        return library.template(name).version
+
+    def text(make_stream, make_text):
+        return job.stream(make_stream()) if stream else make_text()
+
+    if depth == 1:
+        job.set_step("Generating response...")
+        compose_inputs = select_inputs + (language, name, organization, temperature, version("compose_response"))
+        response, compose_reused = reuse_artifact(artifacts, "compose", compose_inputs, lambda: compose_response(demands, examples, email_content, donor_info, actions, additional_messages, additional_guidelines, language, name, organization, temperature, use_cache=use_cache))
+        job.set_step("Checking the response...")
+        response = check_and_repair(response, donor_info, language, name, organization, use_cache=use_cache)
+        return {"response": response, "candidates": [response], "candidate_problems": [candidate_problems(response, donor_info, name, organization)],
+                "artifacts": artifacts, "reused": ["single pass"] if compose_reused else []}
+
+    if depth == 2:
+        job.set_step("Selecting relevant response parts and drafting...")
+        select_draft_inputs = select_inputs + (language, name, organization, version("select_and_draft_response"))
+        (relevant_responses, initial_draft), draft_reused = reuse_artifact(artifacts, "select_draft", select_draft_inputs, lambda: select_and_draft_response(demands, examples, email_content, donor_info, actions, additional_messages, additional_guidelines, language, name, organization, use_cache=use_cache))
+        stage_reuse = [("selection and draft", draft_reused)]
+    else:
+        job.set_step("Selecting relevant response parts...")
+        relevant_responses, select_reused = reuse_artifact(artifacts, "select", select_inputs + (version("select_relevant_responses"),), lambda: select_relevant_responses(demands, examples, email_content, donor_info, actions, additional_messages, additional_guidelines, use_cache=use_cache))
+        job.set_step("Drafting...")
+        draft_inputs = (email_content, actions, additional_messages, additional_guidelines, donor_key, relevant_responses, language, name, organization, version("draft_initial_response"))
+        initial_draft, draft_reused = reuse_artifact(artifacts, "draft", draft_inputs, lambda: text(
+            lambda: draft_initial_response(email_content, actions, additional_messages, additional_guidelines, donor_info, relevant_responses, language, name, organization, use_cache=use_cache, stream=True, demands=demands),
+            lambda: draft_initial_response(email_content, actions, additional_messages, additional_guidelines, donor_info, relevant_responses, language, name, organization, use_cache=use_cache, demands=demands)))
+        stage_reuse = [("selection", select_reused), ("draft", draft_reused)]
+
+    # The refinement needs the complete draft, so it starts once the draft is done
+    refine_inputs = (initial_draft, donor_key, language, name, organization, temperature, version("refine_response"))
+    if candidates > 1:
+        job.set_step(f"Refining {candidates} candidates...")
+        responses, refine_reused = reuse_artifact(artifacts, "refine_candidates", refine_inputs + (candidates,), lambda: refine_candidates(
+            initial_draft, donor_info, language, name, organization, temperature, candidates, use_cache=use_cache))
+    else:
+        job.set_step("Refining...")
+        response, refine_reused = reuse_artifact(artifacts, "refine", refine_inputs, lambda: text(
+            lambda: refine_response(initial_draft, donor_info, language, name, organization, temperature, use_cache=use_cache, stream=True),
+            lambda: refine_response(initial_draft, donor_info, language, name, organization, temperature, use_cache=use_cache)))
+        responses = [response]
+    stage_reuse.append(("refinement", refine_reused))
+    # Every candidate gets the local fixes and the rule check; those that pass come first and
+    # only the first one is repaired if none does. The rules the others still break go to the UI
+    job.set_step("Checking the response...")
+    fixed = [fix_locally(candidate, name, organization) if VALIDATE_REPLIES else candidate for candidate in responses]
+    order = sorted(range(len(responses)), key=lambda i: bool(candidate_problems(fixed[i], donor_info, name, organization)))
+    responses = [check_and_repair(responses[order[0]], donor_info, language, name, organization, use_cache=use_cache)] + [fixed[i] for i in order[1:]]
+    return {"response": responses[0], "candidates": responses,
+            "candidate_problems": [candidate_problems(candidate, donor_info, name, organization) for candidate in responses],
+            "artifacts": artifacts, "reused": [stage for stage, reused in stage_reuse if reused]}
@@ -0,0 +1,189 @@
+# Headless batch mode: pre-draft replies for a backlog of donor emails.
+#
+#   python mailgen_batch.py inbox/ -o drafts.jsonl --workers 4 --name Alexis
+#   python mailgen_batch.py backlog.mbox -o drafts.jsonl --actions "stop sdd"
+#   python mailgen_batch.py backlog.jsonl -o drafts.jsonl
+#
+# JSONL records look like
+#   {"id": "...", "email": "...", "actions": "...", "name": "...",
+#    "donor_info": {"type": "..."}, "additional_messages": "...", "additional_guidelines": "..."}
+# .eml and mbox messages take actions, name and donor type from the command line.
+# Results are appended to the output file one line per email; rerunning the same
+# command skips every id that already has a result there.
+import argparse
+import json
+import mailbox
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email import policy
+from email.parser import BytesParser
+
+from mailgen_agents import PIPELINE_DEPTH, PIPELINE_DEPTHS, generate_reply, get_demands, organization_for, target_language_for
+from mailgen_language import detect_language, is_ambiguous
+from mailgen_metrics import metrics
+from mailgen_preprocess import clean_email
+from mailgen_scheduler import BATCH, request_priority
+from mailgen_validate import get_validator
+
+
+def message_text(message):
+    body = message.get_body(preferencelist=("plain", "html"))
+    if body is None:
+        return ""
+    text = body.get_content()
+    if body.get_content_type() == "text/html":
+        text = re.sub(r"<[^>]+>", " ", text)
+    return text.strip()
+
+
+def read_eml(path):
+    with open(path, "rb") as f:
+        message = BytesParser(policy=policy.default).parse(f)
+    return {"id": os.path.basename(path), "email": message_text(message)}
+
+
+def read_eml_dir(path):
+    for filename in sorted(os.listdir(path)):
+        if filename.endswith(".eml"):
+            yield read_eml(os.path.join(path, filename))
+
+
+def read_mbox(path):
+    box = mailbox.mbox(path, factory=lambda f: BytesParser(policy=policy.default).parse(f))
+    for i, message in enumerate(box):
+        yield {"id": message.get("Message-ID") or f"{os.path.basename(path)}#{i}", "email": message_text(message)}
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if line.strip():
+                record = json.loads(line)
+                record.setdefault("id", f"{os.path.basename(path)}#{i}")
+                if "email" not in record:
+                    record["email"] = record.get("email_content", "")
+                yield record
+
+
+def read_records(path):
+    if os.path.isdir(path):
+        return read_eml_dir(path)
+    if path.endswith(".jsonl"):
+        return read_jsonl(path)
+    if path.endswith(".eml"):
+        return [read_eml(path)]
+    return read_mbox(path)
+
+
+def completed_ids(output_path):
+    # Ids with a successful result; failed ones are retried on the next run
+    done = set()
+    if os.path.exists(output_path):
+        with open(output_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue  # half-written line from a crash
+                if result.get("response"):
+                    done.add(result["id"])
+    return done
+
+
+def process_record(record, defaults, temperature):
+    # Interactive sessions sharing the API key go ahead of the backlog
+    with request_priority(BATCH):
+        return draft_record(record, defaults, temperature)
+
+
+def draft_record(record, defaults, temperature):
+    cleaned_email = clean_email(record["email"])
+    email_content = cleaned_email.text
+    language_result = detect_language(email_content)
+    language = record.get("language") or language_result.language
+    donor_info = record.get("donor_info") or {"type": defaults.donor_type}
+    name = record.get("name", defaults.name)
+    organization = record.get("organization") or organization_for(language)
+    demands = get_demands(email_content)
+    response = generate_reply(demands, email_content, donor_info, record.get("actions", defaults.actions),
+                              record.get("additional_messages", ""), record.get("additional_guidelines", ""),
+                              language, name, organization, temperature, depth=getattr(defaults, "depth", None))
+    return {
+        "id": record["id"],
+        "language": language,
+        "target_language": target_language_for(language),
+        # Mixed or unclear language: worth a look before sending
+        "language_flagged": not record.get("language") and is_ambiguous(language_result),
+        "demands": demands,
+        "tokens_saved": cleaned_email.tokens_saved,
+        "response": response,
+    }
+
+
+def run_batch(input_path, output_path, defaults, workers=4, temperature=0.3, limit=None):
+    done = completed_ids(output_path)
+    records = [record for record in read_records(input_path) if record["id"] not in done and record["email"]]
+    if limit is not None:
+        records = records[:limit]
+    print(f"{len(done)} already done, {len(records)} to process", file=sys.stderr)
+
+    write_lock = threading.Lock()
+    failures = 0
+    # Terminate a line left half-written by a crash before appending. The last byte is read
+    # in binary mode: a text-mode seek could land inside a multibyte character
+    unterminated = False
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            unterminated = f.read(1) != b"\n"
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        if unterminated:
+            out.write("\n")
+        futures = {pool.submit(process_record, record, defaults, temperature): record for record in records}
+        for n, future in enumerate(as_completed(futures), 1):
+            record = futures[future]
+            try:
+                result = future.result()
+            except Exception as exc:
+                failures += 1
+                result = {"id": record["id"], "error": f"{type(exc).__name__}: {exc}"}
+            with write_lock:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+            print(f"[{n}/{len(records)}] {record['id']}", file=sys.stderr)
+    return len(records) - failures, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Draft replies for a directory of .eml files, an mbox or a JSONL file.")
+    parser.add_argument("input", help="directory of .eml files, mbox file or .jsonl file")
+    parser.add_argument("-o", "--output", default="drafts.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="emails processed concurrently")
+    parser.add_argument("--temperature", type=float, default=0.3, help="temperature of the refinement stage")
+    parser.add_argument("--name", default="", help="signature name when a record has none")
+    parser.add_argument("--actions", default="", help="actions undertaken when a record has none")
+    parser.add_argument("--donor-type", default="Other", help="donor type when a record has no donor_info")
+    parser.add_argument("--limit", type=int, help="process at most this many new emails")
+    parser.add_argument("--depth", type=int, choices=PIPELINE_DEPTHS, default=PIPELINE_DEPTH,
+                        help="LLM calls per reply: 3 select/draft/refine, 2 fused select+draft, 1 single pass")
+    args = parser.parse_args(argv)
+
+    succeeded, failed = run_batch(args.input, args.output, args, args.workers, args.temperature, args.limit)
+    print(f"{succeeded} drafted, {failed} failed", file=sys.stderr)
+    for row in metrics.summary():
+        print(f"  {row['stage']}: {row['calls']} calls ({row['cache_hits']} cached), p50 {row['p50']:.2f}s, "
+              f"p95 {row['p95']:.2f}s, {row['prompt_tokens'] + row['completion_tokens']} tokens "
+              f"({row['cached_tokens']} prompt tokens from the provider cache), ${row['cost']:.4f}",
+              file=sys.stderr)
+    validation = get_validator().stats()
+    if validation["checked"]:
+        print(f"  rule check: {validation['pass_rate']:.0%} passed, {validation['fixed_locally']} fixed locally, "
+              f"{validation['repair_calls']} repair calls ({validation['repaired']} repaired)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
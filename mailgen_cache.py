@@ -0,0 +1,99 @@
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    # Same email pasted twice often differs only in whitespace / line endings
+    text = unicodedata.normalize("NFC", text or "")
+    return " ".join(text.split())
+
+
+def content_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+class LRUCache:
+    # In-memory LRU cache with optional TTL, shared by every session of the process
+
+    def __init__(self, maxsize=512, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if self.ttl is None or time.monotonic() - stored_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        # Concurrent sessions asking for the same key wait for a single computation
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                missing = object()
+                value = self.get(key, missing)
+                if value is missing:
+                    value = compute()
+                    self.set(key, value)
+        finally:
+            # Also when compute() raises, or the lock would stay in _key_locks for good
+            with self._lock:
+                self._key_locks.pop(key, None)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+def reuse_artifact(artifacts, stage, inputs, compute):
+    # Per-session intermediate results: a stage is recomputed only when the
+    # fingerprint of its inputs (which include upstream outputs) has changed
+    fingerprint = content_key(*inputs)
+    cached = artifacts.get(stage)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1], True
+    value = compute()
+    artifacts[stage] = (fingerprint, value)
+    return value, False
@@ -0,0 +1,309 @@
+# Local fast path for demand detection: Dutch/French/English keyword rules plus
+# a small naive Bayes model on hashed word n-grams. When it is confident the
+# LLM call is skipped; otherwise detect_demands asks the LLM.
+#
+#   python mailgen_classifier.py train labeled.jsonl      # {"email": "...", "demands": ["..."]} per line
+#   python mailgen_classifier.py evaluate labeled.jsonl
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import threading
+import zlib
+
+from mailgen_cache import content_key
+
+LABELS = [
+    "data change",
+    "tax certificate",
+    "donation adjustment",
+    "complaint",
+    "donation cancellation",
+    "unsubscribe",
+    "general inquiry",
+]
+
+MODEL_PATH = os.environ.get("MAILGEN_CLASSIFIER_PATH", "mailgen_classifier.json")
+HASH_BUCKETS = 2 ** 18
+MODEL_CONFIDENCE = float(os.environ.get("MAILGEN_CLASSIFIER_CONFIDENCE", "0.9"))
+# Without a trained model, rules alone are trusted only on short emails with one
+# matched demand, which rarely carry a second, unmatched one
+RULES_MAX_CHARS = int(os.environ.get("MAILGEN_CLASSIFIER_RULES_MAX_CHARS", "600"))
+
+RULES = {
+    "data change": [
+        r"nieuw (adres|rekeningnummer|e-?mailadres|telefoonnummer)", r"\bverhuisd\b", r"adreswijziging",
+        r"nouvel(le)? (adresse|iban)", r"nouveau (numéro de compte|compte bancaire)", r"\bdéménag", r"changement d'adresse",
+        r"new (address|bank account)", r"\bmoved\b",
+    ],
+    "tax certificate": [
+        r"fiscaal attest", r"belastingattest", r"attest (voor de belastingen|van (mijn )?gift)",
+        r"attestation fiscale", r"certificat fiscal", r"reçu fiscal", r"tax (certificate|receipt)",
+    ],
+    "donation adjustment": [
+        r"(verlagen|verhogen|verminderen|aanpassen|wijzigen)\b.{0,40}\b(gift|bijdrage|bedrag|schenking)",
+        r"\b(gift|bijdrage|bedrag)\b.{0,40}\b(verlagen|verhogen|verminderen|aanpassen)",
+        r"(réduire|diminuer|augmenter|modifier|changer)\b.{0,40}\b(don|montant|contribution)",
+        r"(reduce|lower|increase|change)\b.{0,40}\b(donation|gift|amount)",
+    ],
+    "complaint": [
+        r"\bklacht", r"ontevreden", r"schandalig", r"opdringerig", r"onbeleefd",
+        r"\bplainte", r"mécontent", r"inadmissible", r"scandaleu", r"agressi[fv]", r"harcèlement",
+        r"\bcomplain", r"unacceptable", r"\brude\b",
+    ],
+    "donation cancellation": [
+        r"(stop|stopzetten|stoppen|annuleren|opzeggen|beëindigen|intrekken)\b.{0,60}\b(domicili|mandaat|gift|bijdrage|schenking|steun|doorlopende opdracht)",
+        r"\b(domicili\w*|mandaat|doorlopende opdracht)\b.{0,60}\b(stop|stopzetten|stoppen|annuleren|opzeggen|beëindigen)",
+        r"(arrêter|annuler|résilier|mettre fin|stopper|supprimer)\b.{0,60}\b(domiciliation|mandat|don|ordre permanent|soutien)",
+        r"\b(domiciliation|mandat|ordre permanent)\b.{0,60}\b(arrêter|annuler|résilier|stopper)",
+        r"(cancel|stop)\b.{0,40}\b(direct debit|donation|mandate)",
+    ],
+    "unsubscribe": [
+        r"uitschrijven", r"afmelden", r"geen (mails|e-mails|post|brieven|folders|nieuwsbrief) meer",
+        r"désinscri", r"plus recevoir (de |vos |votre )?(courrier|mails|e-mails|lettres|newsletter|sollicitations|publicités?|brochures)",
+        r"plus de (courrier|mails|e-mails|sollicitations)", r"retirer de (votre|vos) liste", r"unsubscribe",
+        r"no longer (wish to |want to )?receive (your )?(mail|e-?mails|letters|newsletters?)", r"no more (mail|e-?mails|letters|newsletters)",
+    ],
+    # Only there to spot a question next to an obvious demand: never trusted on its own
+    "general inquiry": [
+        r"(wil|zou) (ik )?graag (eens )?weten", r"vraag (me|mij) af", r"kunt u (mij|me) (zeggen|vertellen)",
+        r"je (voudrais|aimerais|souhaite) savoir", r"je me demande", r"pourriez-vous me dire",
+        r"(would|'d) like to know", r"\bi wonder", r"can you tell me",
+    ],
+}
+# A keyword next to these is not a demand ("Je crains de ne pas recevoir mon
+# attestation", "no more questions about my tax certificate"), and a "why" makes
+# it a question or a complaint about something that already happened
+HEDGES = [
+    r"\bno (more |further )?questions", r"geen (verdere )?vragen( meer)?", r"plus de questions",
+    r"\bje crains", r"\bik vrees", r"\bi('m| am) afraid", r"\bi fear",
+    r"\bwaarom\b", r"\bpourquoi\b", r"\bwhy\b",
+]
+# Negated, a cancellation or adjustment keyword asks for the opposite ("Ik wil mijn
+# domiciliëring niet stopzetten", "Je ne veux pas annuler mon don"). Unsubscribe
+# requests are negations themselves ("je ne veux plus recevoir"), so the check is
+# limited to these labels and to the words around the keyword
+NEGATIONS = [
+    r"\bniet\b", r"\bgeen\b", r"\bnooit\b",
+    r"\bn(e\b|['’])(.{0,30}?)\b(pas|plus|jamais)\b",
+    r"\bnot\b", r"n['’]t\b", r"\bnever\b",
+]
+NEGATED_LABELS = ("donation cancellation", "donation adjustment")
+NEGATION_WINDOW = 60
+_HEDGE_RE = re.compile("|".join(HEDGES), re.IGNORECASE)
+_NEGATION_RE = re.compile("|".join(NEGATIONS), re.IGNORECASE)
+_COMPILED_RULES = {label: [re.compile(pattern, re.IGNORECASE) for pattern in patterns] for label, patterns in RULES.items()}
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def rule_labels(text):
+    return [label for label, patterns in _COMPILED_RULES.items() if any(p.search(text) for p in patterns)]
+
+
+def hedged(text, labels):
+    # True when the matched keywords may not mean what they say: the LLM decides
+    if _HEDGE_RE.search(text):
+        return True
+    for label in NEGATED_LABELS:
+        if label not in labels:
+            continue
+        for pattern in _COMPILED_RULES[label]:
+            for match in pattern.finditer(text):
+                if _NEGATION_RE.search(text[max(0, match.start() - NEGATION_WINDOW):match.end() + NEGATION_WINDOW]):
+                    return True
+    return False
+
+
+def features(text):
+    tokens = _TOKEN_RE.findall(text.lower())
+    grams = tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]
+    return [zlib.crc32(gram.encode("utf-8")) % HASH_BUCKETS for gram in grams]
+
+
+def normalize_labels(demands):
+    labels = set()
+    for demand in demands:
+        demand = demand.strip().lower()
+        if not demand:
+            continue
+        for label in LABELS:
+            if label in demand or demand in label:
+                labels.add(label)
+    return labels
+
+
+class NaiveBayesModel:
+    # One-vs-rest multinomial naive Bayes per label over hashed unigrams + bigrams
+
+    def __init__(self, counts=None, totals=None, docs=None, alpha=1.0):
+        self.alpha = alpha
+        self.counts = counts or {label: [{}, {}] for label in LABELS}   # [negative, positive] bucket counts
+        self.totals = totals or {label: [0, 0] for label in LABELS}
+        self.docs = docs or {label: [0, 0] for label in LABELS}
+
+    def train(self, examples):
+        for text, labels in examples:
+            buckets = features(text)
+            for label in LABELS:
+                side = 1 if label in labels else 0
+                counts = self.counts[label][side]
+                for bucket in buckets:
+                    counts[bucket] = counts.get(bucket, 0) + 1
+                self.totals[label][side] += len(buckets)
+                self.docs[label][side] += 1
+        return self
+
+    def probabilities(self, text):
+        buckets = features(text)
+        probabilities = {}
+        for label in LABELS:
+            negative_docs, positive_docs = self.docs[label]
+            if not negative_docs or not positive_docs:
+                continue
+            log_odds = math.log(positive_docs / negative_docs)
+            for bucket in buckets:
+                positive = (self.counts[label][1].get(bucket, 0) + self.alpha) / (self.totals[label][1] + self.alpha * HASH_BUCKETS)
+                negative = (self.counts[label][0].get(bucket, 0) + self.alpha) / (self.totals[label][0] + self.alpha * HASH_BUCKETS)
+                log_odds += math.log(positive / negative)
+            probabilities[label] = 1 / (1 + math.exp(-max(-50.0, min(50.0, log_odds))))
+        return probabilities
+
+    def to_dict(self):
+        return {
+            "alpha": self.alpha,
+            "counts": {label: [{str(k): v for k, v in side.items()} for side in sides] for label, sides in self.counts.items()},
+            "totals": self.totals,
+            "docs": self.docs,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        counts = {label: [{int(k): v for k, v in side.items()} for side in sides] for label, sides in data["counts"].items()}
+        return cls(counts, data["totals"], data["docs"], data.get("alpha", 1.0))
+
+
+class DemandClassifier:
+
+    def __init__(self, model=None):
+        self.model = model
+        self.version = content_key(json.dumps([RULES, HEDGES, NEGATIONS], sort_keys=True), json.dumps(model.to_dict(), sort_keys=True) if model else "")[:12]
+        self.fast_path = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def classify(self, text):
+        # Returns (labels, confident)
+        labels = set(rule_labels(text))
+        if self.model is not None:
+            probabilities = self.model.probabilities(text)
+            model_labels = {label for label, p in probabilities.items() if p >= 0.5}
+            undecided = [p for p in probabilities.values() if 1 - MODEL_CONFIDENCE < p < MODEL_CONFIDENCE]
+            # A rule hit the model doesn't back up is a disagreement: let the LLM decide
+            confident = bool(model_labels) and not undecided and labels <= model_labels and not hedged(text, labels | model_labels)
+            labels |= model_labels
+        else:
+            # Rules alone only decide a single, specific demand; anything more is the LLM's call
+            confident = len(labels) == 1 and "general inquiry" not in labels and len(text) <= RULES_MAX_CHARS and not hedged(text, labels)
+        with self._lock:
+            if confident:
+                self.fast_path += 1
+            else:
+                self.fallbacks += 1
+        return [label for label in LABELS if label in labels], confident
+
+    def stats(self):
+        with self._lock:
+            total = self.fast_path + self.fallbacks
+            return {
+                "model": self.model is not None,
+                "fast_path": self.fast_path,
+                "fallbacks": self.fallbacks,
+                "fallback_rate": self.fallbacks / total if total else 0.0,
+            }
+
+
+def load_examples(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record.get("email") or record.get("email_content", ""), normalize_labels(record["demands"])
+
+
+def train(path, model_path=MODEL_PATH):
+    model = NaiveBayesModel().train(load_examples(path))
+    with open(model_path, "w", encoding="utf-8") as f:
+        json.dump(model.to_dict(), f)
+    return model
+
+
+def evaluate(classifier, examples):
+    total = confident_total = exact = confident_exact = 0
+    per_label = {label: [0, 0, 0] for label in LABELS}   # true positives, false positives, false negatives
+    for text, expected in examples:
+        predicted, confident = classifier.classify(text)
+        predicted = set(predicted)
+        total += 1
+        exact += predicted == expected
+        if confident:
+            confident_total += 1
+            confident_exact += predicted == expected
+        for label in LABELS:
+            per_label[label][0] += label in predicted and label in expected
+            per_label[label][1] += label in predicted and label not in expected
+            per_label[label][2] += label not in predicted and label in expected
+    return {
+        "emails": total,
+        "exact_match": exact / total if total else 0.0,
+        "fallback_rate": 1 - confident_total / total if total else 0.0,
+        "fast_path_exact_match": confident_exact / confident_total if confident_total else 0.0,
+        "per_label": {
+            label: {
+                "precision": tp / (tp + fp) if tp + fp else 0.0,
+                "recall": tp / (tp + fn) if tp + fn else 0.0,
+            }
+            for label, (tp, fp, fn) in per_label.items()
+        },
+    }
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier():
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            model = None
+            if os.path.exists(MODEL_PATH):
+                with open(MODEL_PATH, encoding="utf-8") as f:
+                    model = NaiveBayesModel.from_dict(json.load(f))
+            _classifier = DemandClassifier(model)
+        return _classifier
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train or evaluate the local demand classifier.")
+    parser.add_argument("command", choices=["train", "evaluate"])
+    parser.add_argument("data", help='JSONL with {"email": ..., "demands": [...]} per line')
+    parser.add_argument("--model", default=MODEL_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        model = train(args.data, args.model)
+        print(f"Trained on {sum(model.docs[LABELS[0]])} emails, saved to {args.model}")
+        return 0
+    model = None
+    if os.path.exists(args.model):
+        with open(args.model, encoding="utf-8") as f:
+            model = NaiveBayesModel.from_dict(json.load(f))
+    print(json.dumps(evaluate(DemandClassifier(model), load_examples(args.data)), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+# Near-duplicate detection of incoming emails (MinHash + LSH), so that replies an
+# agent approved for one email of a campaign wave can be offered for the next
+# near-identical ones without running the pipeline again.
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from mailgen_cache import normalize_text
+from mailgen_store import DEFAULT_STORE_PATH
+
+INDEX_PATH = os.environ.get("MAILGEN_DEDUP_PATH", DEFAULT_STORE_PATH)
+NUM_PERMUTATIONS = 64
+BANDS = 16                     # 16 bands x 4 rows: candidates from ~0.5 Jaccard, then verified
+ROWS = NUM_PERMUTATIONS // BANDS
+INDEX_MAX_ENTRIES = int(os.environ.get("MAILGEN_DEDUP_MAX_ENTRIES", "100000"))
+SIMILARITY_THRESHOLD = float(os.environ.get("MAILGEN_DEDUP_THRESHOLD", "0.85"))
+SHINGLE_SIZE = 3
+# Donor details shorter than this are only templated when they appear once in the reply
+SHORT_VALUE_CHARS = 3
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_NUMBER_RE = re.compile(r"\d+([.,]\d+)*")
+_CLOSING_RE = re.compile(r"(groet|groeten|vriendelijke|mvg|cordialement|salutations|bien à vous|regards|merci|dank)", re.IGNORECASE)
+
+
+def shingles(text):
+    # Amounts, dates and the donor's own name differ across a campaign wave: leave them out
+    donor_name = guess_donor_name(text)
+    if donor_name:
+        text = text.replace(donor_name, " ")
+    words = _WORD_RE.findall(_NUMBER_RE.sub("0", normalize_text(text)).lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash_signature(text):
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text)]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def similarity(signature, other):
+    return sum(x == y for x, y in zip(signature, other)) / len(signature)
+
+
+def band_keys(signature):
+    return [f"{band}:{zlib.crc32(json.dumps(signature[band * ROWS:(band + 1) * ROWS]).encode())}" for band in range(BANDS)]
+
+
+def guess_donor_name(email_content):
+    # The donor usually signs with their name on the last line
+    lines = [line.strip() for line in email_content.strip().splitlines() if line.strip()]
+    if not lines:
+        return None
+    last = lines[-1].rstrip(".,")
+    words = last.split()
+    if 1 <= len(words) <= 4 and all(word[:1].isupper() for word in words) and not any(c.isdigit() for c in last) \
+            and not _CLOSING_RE.search(last):
+        return last
+    return None
+
+
+def _word_re(value):
+    return re.compile(rf"(?<!\w){re.escape(value)}(?!\w)")
+
+
+def make_template(reply, email_content, name, organization, donor_info):
+    # Replace everything specific to this donor / agent with markers, as whole words
+    # and longest value first. None when that can't be done safely: one value behind
+    # two markers, or a short value ("3", "20") that appears more than once
+    values = {}
+    donor_name = guess_donor_name(email_content)
+    if donor_name:
+        values["donor_name"] = donor_name
+        if " " in donor_name:
+            values["donor_first_name"] = donor_name.split()[0]
+    if name:
+        values["agent_name"] = name
+    if organization:
+        values["organization"] = organization
+    for key, value in donor_info.items():
+        if key != "type" and isinstance(value, str) and value.strip():
+            values[key] = value.strip()
+
+    template = reply
+    markers = {}
+    for key, value in sorted(values.items(), key=lambda item: -len(item[1])):
+        if value in markers:
+            return None
+        pattern = _word_re(value)
+        occurrences = len(pattern.findall(template))
+        if not occurrences:
+            continue
+        if len(value) < SHORT_VALUE_CHARS and occurrences > 1:
+            return None
+        markers[value] = key
+        template = pattern.sub(f"⟦{key}⟧", template)
+    return template
+
+
+def fill_template(template, email_content, name, organization, donor_info):
+    reply = template.replace("⟦agent_name⟧", name or "").replace("⟦organization⟧", organization or "")
+    donor_name = guess_donor_name(email_content)
+    if donor_name:
+        reply = reply.replace("⟦donor_name⟧", donor_name).replace("⟦donor_first_name⟧", donor_name.split()[0])
+    else:
+        reply = re.sub(r"[ \t]*⟦donor_(first_)?name⟧", "", reply)
+    for key in re.findall(r"⟦(\w+)⟧", reply):
+        value = donor_info.get(key)
+        if not isinstance(value, str) or not value.strip():
+            return None   # the earlier reply mentions a donor detail we don't have for this donor
+        reply = reply.replace(f"⟦{key}⟧", value.strip())
+    return reply
+
+
+class ReplyIndex:
+
+    def __init__(self, path=INDEX_PATH, max_entries=INDEX_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS approved_replies ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, language TEXT, donor_type TEXT, email TEXT, "
+            "template TEXT, signature TEXT, created_at REAL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS approved_reply_bands (band TEXT, reply_id INTEGER)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS approved_reply_bands_band ON approved_reply_bands (band)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS approved_reply_bands_reply ON approved_reply_bands (reply_id)")
+        self._conn.commit()
+
+    def add(self, email_content, reply, language, name, organization, donor_info):
+        template = make_template(reply, email_content, name, organization, donor_info)
+        if template is None:
+            return None
+        signature = minhash_signature(email_content)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO approved_replies (language, donor_type, email, template, signature, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (language, donor_info.get("type"), email_content, template, json.dumps(signature), time.time()),
+            )
+            self._conn.executemany("INSERT INTO approved_reply_bands VALUES (?, ?)",
+                                   [(band, cursor.lastrowid) for band in band_keys(signature)])
+            # Oldest approvals go first
+            self._conn.execute(
+                "DELETE FROM approved_replies WHERE id IN ("
+                "SELECT id FROM approved_replies ORDER BY id DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+            )
+            self._conn.execute("DELETE FROM approved_reply_bands WHERE reply_id < (SELECT MIN(id) FROM approved_replies)")
+            self._conn.commit()
+        return cursor.lastrowid
+
+    def find(self, email_content, language, name, organization, donor_info, threshold=SIMILARITY_THRESHOLD):
+        # Best approved reply for a near-duplicate email with the same language and donor type,
+        # filled in for the current donor: (similarity, reply) or None
+        signature = minhash_signature(email_content)
+        bands = band_keys(signature)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT r.id, r.template, r.signature FROM approved_reply_bands b "
+                "JOIN approved_replies r ON r.id = b.reply_id "
+                f"WHERE b.band IN ({','.join('?' * len(bands))}) AND r.language = ? AND r.donor_type = ? "
+                "ORDER BY r.id DESC",
+                (*bands, language, donor_info.get("type")),
+            ).fetchall()
+        best = None
+        for _, template, stored_signature in rows:
+            score = similarity(signature, json.loads(stored_signature))
+            if score >= threshold and (best is None or score > best[0]):
+                reply = fill_template(template, email_content, name, organization, donor_info)
+                if reply is not None:
+                    best = (score, reply)
+        return best
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM approved_replies").fetchone()[0]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_reply_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ReplyIndex()
+        return _index
@@ -0,0 +1,113 @@
+import math
+import re
+import threading
+from collections import Counter, defaultdict, namedtuple
+
+from mailgen_cache import content_key
+
+EXAMPLES_TOP_K = 6
+EXAMPLES_PER_DEMAND = 2
+
+ExampleRecord = namedtuple("ExampleRecord", ["category", "text", "placeholders"])
+
+_PLACEHOLDER_RE = re.compile(r"\[[^\]]+\]")
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    # Crude prefix stemming keeps "unsubscribe"/"unsubscribing" or "annulation"/"annuler" together
+    return [token[:6] for token in _TOKEN_RE.findall(text.lower()) if len(token) > 2]
+
+
+def example_record(category, text):
+    text = text.strip()
+    return ExampleRecord(category, text, tuple(dict.fromkeys(_PLACEHOLDER_RE.findall(text))))
+
+
+class ExampleIndex:
+    # BM25 over the example corpus, with a boost for categories matching the detected demands
+
+    def __init__(self, records, k1=1.5, b=0.75):
+        self.records = records
+        self.k1 = k1
+        self.b = b
+        self.by_category = defaultdict(list)
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for i, record in enumerate(records):
+            self.by_category[record.category].append(i)
+            counts = Counter(tokenize(record.category + " " + record.text))
+            self.lengths.append(sum(counts.values()))
+            for token, count in counts.items():
+                self.postings[token].append((i, count))
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        self.category_tokens = {category: set(tokenize(category)) for category in self.by_category}
+
+    def scores(self, query):
+        scores = defaultdict(float)
+        n = len(self.records)
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, count in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / self.avg_length)
+                scores[i] += idf * count * (self.k1 + 1) / (count + norm)
+        return scores
+
+    def categories_for(self, demand):
+        tokens = set(tokenize(demand))
+        if not tokens:
+            return []
+        return [category for category, category_tokens in self.category_tokens.items() if tokens <= category_tokens]
+
+    def search(self, demands, email_content="", k=EXAMPLES_TOP_K, per_demand=EXAMPLES_PER_DEMAND):
+        if isinstance(demands, str):
+            demands = demands.split(",")
+        scores = self.scores(" ".join(demands) + " " + (email_content or ""))
+
+        def rank(indices):
+            return sorted(indices, key=lambda i: (-scores.get(i, 0.0), i))
+
+        selected = []
+        # Every detected demand with a matching category gets its best examples first
+        for demand in demands:
+            for category in self.categories_for(demand):
+                for i in rank(self.by_category[category])[:per_demand]:
+                    if i not in selected:
+                        selected.append(i)
+        for i in rank(i for i in scores if scores[i] > 0):
+            if len(selected) >= k:
+                break
+            if i not in selected:
+                selected.append(i)
+        return [self.records[i] for i in selected]
+
+
+def format_examples(records):
+    groups = defaultdict(list)
+    for record in records:
+        groups[record.category].append("***Response***\n\n" + record.text)
+    if not groups:
+        return "No matching examples."
+    return "\n\n".join(
+        f"### EXAMPLES OF {category.upper()}\n\n" + "\n\n---\n".join(texts)
+        for category, texts in groups.items()
+    )
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_example_index(records):
+    # Built once per distinct corpus and shared by all sessions
+    key = content_key(*(f"{record.category}\n{record.text}" for record in records))
+    with _lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = ExampleIndex(list(records))
+            _indexes.clear()
+            _indexes[key] = index
+        return index
@@ -0,0 +1,144 @@
+# Background jobs for work that must outlive a Streamlit rerun: the script only
+# keeps the job id in st.session_state and polls the process-level registry,
+# so touching a widget mid-generation no longer throws away paid-for LLM work.
+import contextvars
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.environ.get("MAILGEN_JOB_WORKERS", "8"))
+JOB_TTL_SECONDS = float(os.environ.get("MAILGEN_JOB_TTL_SECONDS", "3600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    # Progress is written by the worker and read by any rerun of the session that owns it
+
+    def __init__(self, job_id, session=None):
+        self.id = job_id
+        self.session = session
+        self.status = QUEUED
+        self.step = ""
+        self.partial = ""
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def set_step(self, step):
+        # A new step starts a new partial text
+        self.check_cancelled()
+        with self._lock:
+            self.step = step
+            self.partial = ""
+
+    def append(self, text):
+        self.check_cancelled()
+        with self._lock:
+            self.partial += text
+
+    def stream(self, chunks):
+        # Pass a chunk iterator through, keeping what arrived so far visible to pollers
+        for chunk in chunks:
+            self.append(chunk)
+        return self.partial
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise JobCancelled(self.id)
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def snapshot(self):
+        with self._lock:
+            return {"id": self.id, "status": self.status, "step": self.step, "partial": self.partial,
+                    "error": self.error, "seconds": round((self.finished_at or time.time()) - self.created_at, 2)}
+
+
+class JobRunner:
+
+    def __init__(self, workers=JOB_WORKERS, ttl=JOB_TTL_SECONDS):
+        # Separate from the stage pool in mailgen_tasks, so long generations can't starve prefetches
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mailgen-job")
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, session=None, **kwargs):
+        # fn(job, *args, **kwargs) runs on the pool; its return value becomes job.result
+        job = Job(uuid.uuid4().hex, session)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self.executor.submit(contextvars.copy_context().run, self._run, job, fn, args, kwargs)
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+        for job in jobs:
+            counts[job.status] += 1
+        return counts
+
+    def _run(self, job, fn, args, kwargs):
+        try:
+            job.check_cancelled()
+            job.status = RUNNING
+            result = fn(job, *args, **kwargs)
+        except JobCancelled:
+            status = CANCELLED
+        except Exception as exc:
+            job.error = f"{type(exc).__name__}: {exc}"
+            status = FAILED
+        else:
+            job.result = result
+            status = DONE
+        # finished_at first: a finished status is what other threads poll for
+        job.finished_at = time.time()
+        job.status = status
+
+    def _prune(self):
+        # Results nobody came back for are dropped after the TTL
+        cutoff = time.time() - self.ttl
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at is not None and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+        return _runner
@@ -0,0 +1,84 @@
+# Language detection restricted to the languages we answer in. langdetect's
+# profiles are loaded once per process, the detector is seeded so a rerun can't
+# flip the language (and with it the organization and target language), and
+# results are cached by content hash.
+import os
+import re
+import threading
+from collections import namedtuple
+
+from mailgen_cache import LRUCache, content_key, normalize_text
+
+LANGUAGES = os.environ.get("MAILGEN_LANGUAGES", "nl,fr,en").split(",")
+DEFAULT_LANGUAGE = LANGUAGES[0]
+# Below this probability for the best language the email is flagged as mixed or unclear
+MIN_CONFIDENCE = float(os.environ.get("MAILGEN_LANGUAGE_MIN_CONFIDENCE", "0.8"))
+SEED = 0
+# Sentences shorter than this are too short to tell languages apart
+MIN_SEGMENT_CHARS = 20
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+LanguageResult = namedtuple("LanguageResult", ["language", "confidence", "probabilities"])
+
+_factory = None
+_factory_lock = threading.Lock()
+_results = LRUCache(maxsize=5000)
+
+
+def get_detector_factory():
+    global _factory
+    with _factory_lock:
+        if _factory is None:
+            from langdetect.detector_factory import PROFILES_DIRECTORY, DetectorFactory
+
+            factory = DetectorFactory()
+            profiles = []
+            for language in LANGUAGES:
+                with open(os.path.join(PROFILES_DIRECTORY, language), encoding="utf-8") as f:
+                    profiles.append(f.read())
+            factory.load_json_profile(profiles)
+            factory.set_seed(SEED)
+            _factory = factory
+        return _factory
+
+
+def _probabilities(text):
+    from langdetect.lang_detect_exception import LangDetectException
+
+    detector = get_detector_factory().create()
+    detector.append(text)
+    try:
+        return {candidate.lang: round(candidate.prob, 4) for candidate in detector.get_probabilities()}
+    except LangDetectException:
+        # No letters to go on (empty, only numbers or links)
+        return {}
+
+
+def _detect(text):
+    probabilities = _probabilities(text)
+    if not probabilities:
+        return LanguageResult(DEFAULT_LANGUAGE, 0.0, {})
+    language = max(probabilities, key=probabilities.get)
+    confidence = probabilities[language]
+
+    # A paragraph in another language barely moves the whole-text score, so the
+    # share of sentences (by length) in the main language caps the confidence
+    sentences = [sentence for sentence in _SENTENCE_RE.split(text) if len(sentence) >= MIN_SEGMENT_CHARS]
+    if len(sentences) > 1:
+        main = sum(len(sentence) for sentence in sentences if _top_language(sentence) == language)
+        confidence = min(confidence, round(main / sum(len(sentence) for sentence in sentences), 4))
+    return LanguageResult(language, confidence, probabilities)
+
+
+def _top_language(text):
+    probabilities = _probabilities(text)
+    return max(probabilities, key=probabilities.get) if probabilities else None
+
+
+def detect_language(text):
+    text = normalize_text(text)
+    return _results.get_or_compute(content_key(text), lambda: _detect(text))
+
+
+def is_ambiguous(result):
+    return result.confidence < MIN_CONFIDENCE
@@ -0,0 +1,180 @@
+# Prompt templates and example responses as data: library/prompts.yaml and one
+# YAML file per example category in library/examples/. Adding a sample response is
+# a file edit the running app picks up: the files' mtimes are checked at most every
+# MAILGEN_LIBRARY_CHECK_SECONDS and only the files that changed are parsed again.
+# Every template and example category carries a content hash, for cache keys.
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+
+import yaml
+
+from mailgen_cache import content_key
+from mailgen_examples import example_record, format_examples
+
+LIBRARY_PATH = os.environ.get("MAILGEN_LIBRARY_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "library"))
+CHECK_SECONDS = float(os.environ.get("MAILGEN_LIBRARY_CHECK_SECONDS", "2"))
+
+PROMPTS_FILE = "prompts.yaml"
+EXAMPLES_DIR = "examples"
+_SNIPPET_RE = re.compile(r"<<(\w+)>>")
+
+Template = namedtuple("Template", ["name", "system", "human", "version"])
+
+
+class LibraryError(Exception):
+    pass
+
+
+def compile_templates(data):
+    # {name: Template} with the <<snippets>> filled in
+    snippets = {name: text.rstrip("\n") for name, text in (data.get("snippets") or {}).items()}
+
+    def expand(text):
+        return _SNIPPET_RE.sub(lambda match: snippets[match.group(1)], text)
+
+    templates = {}
+    for name, parts in (data.get("templates") or {}).items():
+        try:
+            system, human = expand(parts["system"]), expand(parts["human"])
+        except KeyError as exc:
+            raise LibraryError(f"template {name}: missing {exc}") from None
+        templates[name] = Template(name, system, human, content_key(system, human)[:12])
+    return templates
+
+
+def load_examples(data):
+    category = str(data.get("category", "")).strip().lower()
+    if not category:
+        raise LibraryError("examples file without a category")
+    return [example_record(category, text) for text in data.get("responses") or [] if text and text.strip()]
+
+
+class Library:
+    # Parsed files are kept per path with their mtime; the combined views
+    # (templates, example records and corpus text) are rebuilt when one changes
+
+    def __init__(self, path=LIBRARY_PATH, check_seconds=CHECK_SECONDS):
+        self.path = path
+        self.check_seconds = check_seconds
+        self.version = ""
+        self.examples_version = ""
+        self.errors = {}
+        self.reloads = 0
+        self._files = {}
+        self._templates = {}
+        self._records = []
+        self._by_category = {}
+        self._examples_text = ""
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+        if not self._templates:
+            raise LibraryError(f"no prompt templates in {os.path.join(path, PROMPTS_FILE)}: {self.errors}")
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._checked_at < self.check_seconds:
+                return False
+            self._checked_at = now
+            paths = self._paths()
+            changed = set(self._files) - set(paths)
+            for path in changed:
+                del self._files[path]
+            for path in paths:
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except OSError:
+                    continue
+                if path in self._files and self._files[path][0] == mtime:
+                    continue
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        data = yaml.safe_load(f) or {}
+                    parsed = compile_templates(data) if os.path.basename(path) == PROMPTS_FILE else load_examples(data)
+                except (OSError, yaml.YAMLError, LibraryError, TypeError, AttributeError) as exc:
+                    # A file saved half-way keeps serving its last good version
+                    self.errors[path] = f"{type(exc).__name__}: {exc}"
+                    continue
+                self.errors.pop(path, None)
+                self._files[path] = (mtime, parsed)
+                changed.add(path)
+            if changed:
+                self._rebuild()
+            return bool(changed)
+
+    def template(self, name):
+        self.refresh()
+        try:
+            return self._templates[name]
+        except KeyError:
+            raise LibraryError(f"no template named {name} in {os.path.join(self.path, PROMPTS_FILE)}") from None
+
+    def examples(self, category=None):
+        self.refresh()
+        if category is None:
+            return list(self._records)
+        return list(self._by_category.get(category.lower(), ()))
+
+    def categories(self):
+        self.refresh()
+        return list(self._by_category)
+
+    def examples_text(self):
+        # The whole corpus in the "### EXAMPLES OF ..." layout the prompts expect
+        self.refresh()
+        return self._examples_text
+
+    def versions(self):
+        self.refresh()
+        with self._lock:
+            versions = {f"template:{name}": template.version for name, template in self._templates.items()}
+            versions.update({f"examples:{category}": content_key(*(record.text for record in records))[:12]
+                             for category, records in self._by_category.items()})
+        return versions
+
+    def stats(self):
+        return {"path": self.path, "version": self.version, "examples_version": self.examples_version, "templates": len(self._templates), "examples": len(self._records),
+                "categories": len(self._by_category), "reloads": self.reloads, "errors": dict(self.errors)}
+
+    def _paths(self):
+        paths = [os.path.join(self.path, PROMPTS_FILE)]
+        examples_dir = os.path.join(self.path, EXAMPLES_DIR)
+        if os.path.isdir(examples_dir):
+            # File name order is corpus order, so the prompt prefix stays stable
+            paths += [os.path.join(examples_dir, name) for name in sorted(os.listdir(examples_dir)) if name.endswith((".yaml", ".yml"))]
+        return paths
+
+    def _rebuild(self):
+        templates, records = {}, []
+        for path, (_, parsed) in sorted(self._files.items()):
+            if isinstance(parsed, dict):
+                templates.update(parsed)
+            else:
+                records.extend(parsed)
+        by_category = {}
+        for record in records:
+            by_category.setdefault(record.category, []).append(record)
+        self._templates = templates
+        self._records = records
+        self._by_category = by_category
+        self._examples_text = format_examples(records)
+        self.examples_version = content_key(self._examples_text)[:12]
+        self.version = content_key(*(f"{name}={template.version}" for name, template in sorted(templates.items())),
+                                   self.examples_version)[:12]
+        self.reloads += 1
+
+
+_library = None
+_library_lock = threading.Lock()
+
+
+def get_library():
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = Library()
+        return _library
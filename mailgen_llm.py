@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+
+from mailgen_cache import content_key
+from mailgen_metrics import metrics, usage_of
+from mailgen_scheduler import COMPLETION_TOKENS_ESTIMATE, estimate_tokens, get_scheduler
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get("MAILGEN_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.environ.get("MAILGEN_HTTP_KEEPALIVE_SECONDS", "120"))
+HTTP_TIMEOUT_SECONDS = float(os.environ.get("MAILGEN_HTTP_TIMEOUT_SECONDS", "120"))
+
+_lock = threading.Lock()
+_http_client = None
+_llms = {}
+_chains = {}
+
+
+# httpx, langchain and openai are imported on first use (or by the warm-up
+# thread, see mailgen_warmup), so they don't hold up the app's first render
+def get_http_client():
+    # One keep-alive connection pool for every OpenAI call made by this process
+    global _http_client
+    import httpx
+
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+                ),
+                timeout=HTTP_TIMEOUT_SECONDS,
+            )
+        return _http_client
+
+
+def get_llm(model):
+    from langchain_openai import ChatOpenAI
+
+    http_client = get_http_client()
+    with _lock:
+        if model not in _llms:
+            # Retries are handled by the scheduler, which needs the rate-limit headers
+            _llms[model] = ChatOpenAI(model_name=model, http_client=http_client, max_retries=0,
+                                      include_response_headers=True, stream_usage=True)
+        return _llms[model]
+
+
+class StageChain:
+    # Prompt + client pair built once per stage; temperature is given per call.
+    # json_output asks the API for a JSON object (the prompt must mention JSON)
+
+    def __init__(self, stage, model, system_template, human_template, json_output=False):
+        from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+
+        self.stage = stage
+        self.model = model
+        self.json_output = json_output
+        self.call_options = {"response_format": {"type": "json_object"}} if json_output else {}
+        self.version = content_key(system_template, human_template, json_output)[:12]
+        self.prompt = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(system_template),
+            HumanMessagePromptTemplate.from_template(human_template)
+        ])
+        self.llm = get_llm(model)
+
+    def run(self, temperature, **inputs):
+        messages = self.prompt.format_messages(**inputs)
+        start = time.perf_counter()
+        message = get_scheduler().call(self.model, estimate_tokens(messages),
+                                       lambda: self.llm.invoke(messages, temperature=temperature, **self.call_options))
+        prompt_tokens, completion_tokens, cached_tokens = usage_of(message)
+        metrics.record(self.stage, self.model, time.perf_counter() - start, prompt_tokens, completion_tokens,
+                       cached_tokens=cached_tokens)
+        return message.content
+
+    def run_many(self, temperature, n, **inputs):
+        # n answers to the same prompt in one request ("n" parameter): the prompt is sent and billed once
+        messages = self.prompt.format_messages(**inputs)
+        start = time.perf_counter()
+        tokens = estimate_tokens(messages) + (n - 1) * COMPLETION_TOKENS_ESTIMATE
+        generations = get_scheduler().call(self.model, tokens, lambda: self.llm.generate(
+            [messages], temperature=temperature, n=n, **self.call_options).generations[0])
+        # Every choice carries the usage of the whole request
+        prompt_tokens, completion_tokens, cached_tokens = usage_of(generations[0].message)
+        metrics.record(self.stage, self.model, time.perf_counter() - start, prompt_tokens, completion_tokens,
+                       cached_tokens=cached_tokens, candidates=n)
+        return [generation.message.content for generation in generations]
+
+    def stream(self, temperature, **inputs):
+        messages = self.prompt.format_messages(**inputs)
+        start = time.perf_counter()
+        first_token = None
+        usage = (0, 0, 0)
+        chunks = get_scheduler().stream(self.model, estimate_tokens(messages),
+                                        lambda: self.llm.stream(messages, temperature=temperature, **self.call_options))
+        try:
+            for chunk in chunks:
+                if chunk.usage_metadata:
+                    usage = usage_of(chunk)
+                if chunk.content:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    yield chunk.content
+        finally:
+            metrics.record(self.stage, self.model, time.perf_counter() - start, usage[0], usage[1],
+                           cached_tokens=usage[2], first_token_seconds=first_token)
+
+
+def get_chain(stage, model, system_template, human_template, json_output=False):
+    # One chain per stage and model: a template edited in the library (hot reload)
+    # replaces its chain instead of adding one next to it for the life of the process
+    key = (stage, model)
+    version = (content_key(system_template, human_template), json_output)
+    with _lock:
+        entry = _chains.get(key)
+    if entry is None or entry[0] != version:
+        chain = StageChain(stage, model, system_template, human_template, json_output)
+        with _lock:
+            entry = _chains.get(key)
+            if entry is None or entry[0] != version:
+                entry = _chains[key] = (version, chain)
+    return entry[1]
+
+
+def registry_stats():
+    with _lock:
+        return {"clients": len(_llms), "chains": len(_chains)}
@@ -0,0 +1,213 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# USD per million tokens (input, output, cached input)
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00, 1.25),
+    "gpt-4o-mini": (0.15, 0.60, 0.075),
+}
+MODEL_PRICES.update({model: tuple(prices) for model, prices in json.loads(os.environ.get("MAILGEN_MODEL_PRICES", "{}")).items()})
+
+METRICS_PATH = os.environ.get("MAILGEN_METRICS_PATH")
+METRICS_PORT = os.environ.get("MAILGEN_METRICS_PORT")
+MAX_RECORDS = 10000
+LATENCY_WINDOW = 1000
+
+_session = contextvars.ContextVar("mailgen_session", default=None)
+
+
+def set_session(session_id):
+    _session.set(session_id)
+
+
+def current_session():
+    return _session.get()
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    # cached_tokens are the part of prompt_tokens served from the provider's prompt cache
+    prices = MODEL_PRICES.get(model, (0.0, 0.0))
+    input_price, output_price = prices[:2]
+    cached_price = prices[2] if len(prices) > 2 else input_price
+    return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# Stages recorded without a request to the provider: the demand classifier, the
+# reply validator and replies reused from an approved near-duplicate
+LOCAL_STAGES = ("classify_demands", "validate_reply", "near_duplicate")
+
+
+def llm_calls(rows):
+    # Requests actually sent to the provider, from summary() rows
+    return sum(row["calls"] - row["cache_hits"] for row in rows if row["stage"] not in LOCAL_STAGES)
+
+
+def usage_of(message):
+    # (prompt tokens, completion tokens, prompt tokens read from the provider's prompt cache)
+    usage = getattr(message, "usage_metadata", None) or {}
+    cached = (usage.get("input_token_details") or {}).get("cache_read") or 0
+    return usage.get("input_tokens", 0), usage.get("output_tokens", 0), cached
+
+
+class Metrics:
+
+    def __init__(self, path=METRICS_PATH):
+        self.path = path
+        self.records = deque(maxlen=MAX_RECORDS)
+        self._latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self._model_latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self._totals = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+
+    def record(self, stage, model, seconds, prompt_tokens=0, completion_tokens=0, cache_hit=False, cached_tokens=0, **extra):
+        record = {
+            "time": time.time(),
+            "session": _session.get(),
+            "stage": stage,
+            "model": model,
+            "seconds": round(seconds, 4),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": cached_tokens,
+            "cache_hit": cache_hit,
+            "cost": 0.0 if cache_hit else estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens),
+        }
+        record.update(extra)
+        with self._lock:
+            self.records.append(record)
+            self._latencies[stage].append(seconds)
+            if not cache_hit:
+                self._model_latencies[(stage, model)].append(seconds)
+            totals = self._totals[(stage, model)]
+            totals["calls"] += 1
+            totals["cache_hits"] += cache_hit
+            totals["seconds"] += seconds
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["cached_tokens"] += cached_tokens
+            totals["cost"] += record["cost"]
+            for key, value in extra.items():
+                if isinstance(value, (int, float)):
+                    totals[key] += value
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+        return record
+
+    def recent_latency(self, stage, model, q, min_samples=5):
+        # Latency percentile of recent real (not cached) calls, None until there are enough
+        with self._lock:
+            values = list(self._model_latencies.get((stage, model), ()))
+        return percentile(values, q) if len(values) >= min_samples else None
+
+    def reset(self):
+        with self._lock:
+            self.records.clear()
+            self._latencies.clear()
+            self._model_latencies.clear()
+            self._totals.clear()
+
+    def summary(self, session=None):
+        # Per-stage aggregates, for one session or (session=None) the whole process
+        with self._lock:
+            records = [r for r in self.records if session is None or r["session"] == session]
+        stages = {}
+        for record in records:
+            stage = stages.setdefault(record["stage"], {"calls": 0, "cache_hits": 0, "prompt_tokens": 0,
+                                                        "completion_tokens": 0, "cached_tokens": 0, "cost": 0.0,
+                                                        "latencies": []})
+            stage["calls"] += 1
+            stage["cache_hits"] += record["cache_hit"]
+            stage["prompt_tokens"] += record["prompt_tokens"]
+            stage["completion_tokens"] += record["completion_tokens"]
+            stage["cached_tokens"] += record.get("cached_tokens", 0)
+            stage["cost"] += record["cost"]
+            stage["latencies"].append(record["seconds"])
+        rows = []
+        for name, stage in stages.items():
+            latencies = stage.pop("latencies")
+            stage.update(stage=name, p50=percentile(latencies, 0.5), p95=percentile(latencies, 0.95),
+                         cost=round(stage["cost"], 5))
+            rows.append(stage)
+        return rows
+
+    def to_jsonl(self):
+        with self._lock:
+            return "".join(json.dumps(record) + "\n" for record in self.records)
+
+    def to_prometheus(self):
+        lines = [
+            "# TYPE mailgen_llm_calls_total counter",
+            "# TYPE mailgen_llm_cache_hits_total counter",
+            "# TYPE mailgen_llm_seconds_total counter",
+            "# TYPE mailgen_llm_tokens_total counter",
+            "# TYPE mailgen_llm_cost_usd_total counter",
+            "# TYPE mailgen_llm_latency_seconds summary",
+        ]
+        with self._lock:
+            totals = {key: dict(value) for key, value in self._totals.items()}
+            latencies = {stage: list(values) for stage, values in self._latencies.items()}
+        for (stage, model), values in sorted(totals.items()):
+            labels = f'stage="{stage}",model="{model}"'
+            lines.append(f"mailgen_llm_calls_total{{{labels}}} {values['calls']:g}")
+            lines.append(f"mailgen_llm_cache_hits_total{{{labels}}} {values['cache_hits']:g}")
+            lines.append(f"mailgen_llm_seconds_total{{{labels}}} {values['seconds']:.4f}")
+            for kind in ("prompt", "completion", "cached"):
+                lines.append(f'mailgen_llm_tokens_total{{{labels},kind="{kind}"}} {values[kind + "_tokens"]:g}')
+            lines.append(f"mailgen_llm_cost_usd_total{{{labels}}} {values['cost']:.6f}")
+        for stage, values in sorted(latencies.items()):
+            for q in (0.5, 0.95):
+                lines.append(f'mailgen_llm_latency_seconds{{stage="{stage}",quantile="{q}"}} {percentile(values, q):.4f}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.startswith("/metrics.jsonl"):
+            body, content_type = metrics.to_jsonl(), "application/jsonl"
+        elif self.path.startswith("/metrics"):
+            body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT):
+    # Prometheus scrape endpoint (/metrics) and raw trace (/metrics.jsonl), once per process
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="mailgen-metrics", daemon=True).start()
+        return _server
@@ -0,0 +1,111 @@
+import re
+from collections import namedtuple
+
+# Deterministic clean-up of pasted donor emails before they are sent to the
+# LLM stages: quoted reply history, forwarded headers, signatures, phone
+# footers and legal disclaimers are cut. The original text is kept for display.
+
+CleanedEmail = namedtuple("CleanedEmail", ["text", "original", "removed", "tokens_saved"])
+
+_REPLY_HEADER_RE = re.compile(
+    r"^\s*(op|le|on|am|el)\s.{4,300}?\b(schreef|geschreven|a écrit|wrote|schrieb|escribió)\b(.*):\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+# A quoted header has a full date (a year, a time or dd/mm/yy) and a sender: an
+# address, or nothing but a name between the verb and the colon. "Op 12 maart schreef ik
+# jullie al ..., en ik kreeg als antwoord:" is the donor's own sentence.
+_HEADER_DATE_RE = re.compile(r"\b(\d{4}|\d{1,2}[:h.]\d{2}|\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4})\b")
+_HEADER_ADDRESS_RE = re.compile(r"<?[\w.+-]+@[\w-]+(\.[\w-]+)+>?")
+_HEADER_SENDER_RE = re.compile(r"^\s*([^\W\d][\w.'-]*(\s+[^\W\d][\w.'-]*){0,3})?\s*$")
+_SEPARATOR_RE = re.compile(
+    r"^\s*(-{2,}\s*(original message|oorspronkelijk bericht|origineel bericht|message d'origine|"
+    r"message original|forwarded message|doorgestuurd bericht|message transféré)\s*-{2,}|"
+    r"begin forwarded message:|début du message réexpédié\s*:|begin doorgestuurd bericht:|_{10,})\s*$",
+    re.IGNORECASE,
+)
+_HEADER_FROM_RE = re.compile(r"^\s*\*?(from|van|de|von)\s*:\*?\s", re.IGNORECASE)
+_HEADER_FIELD_RE = re.compile(
+    r"^\s*\*?(sent|verzonden|envoyé|date|datum|to|aan|à|subject|onderwerp|objet|cc)\s*:", re.IGNORECASE
+)
+_SIGNATURE_DELIMITER_RE = re.compile(r"^-- ?$")
+_MOBILE_FOOTER_RE = re.compile(
+    r"^\s*(sent from my|verzonden (vanaf|met) mijn|verstuurd (vanaf|met) mijn|envoyé (de|depuis) mon|"
+    r"get outlook for|télécharger outlook pour|outlook voor)\b.*$",
+    re.IGNORECASE,
+)
+_SIGN_OFF_RE = re.compile(
+    r"^\s*(met )?(vriendelijke|hartelijke|beste|warme) groet(en)?|^\s*(groet(en|jes)?|mvg|cordialement|bien cordialement|"
+    r"bien à (vous|toi)|salutations|meilleures salutations|sincères salutations|(kind|best|warm) regards|regards|"
+    r"sincerely|yours (sincerely|faithfully))\b",
+    re.IGNORECASE | re.MULTILINE,
+)
+# Only trailing paragraphs after the sign-off can be a disclaimer: the same words
+# in the message itself are the donor's ("niet vertrouwelijk behandeld")
+_DISCLAIMER_RE = re.compile(
+    r"(confidential|vertrouwelijk|confidentiel|disclaimer|this e-?mail and any attachments|"
+    r"ce (message|courriel) et (toutes )?les pièces jointes|dit bericht (en eventuele bijlagen )?is uitsluitend|"
+    r"consider the environment|denk aan het milieu|pensez à l'environnement|"
+    r"avant d'imprimer|voor u dit bericht print)",
+    re.IGNORECASE,
+)
+_GREETING_RE = re.compile(r"^\s*(beste|geachte|dag|hallo|hoi|bonjour|bonsoir|madame|monsieur|cher|chère|dear|hello|hi)\b[^\n]*\n?", re.IGNORECASE)
+
+# Fewer words than this left besides the greeting means the cut took the message with it
+MIN_BODY_WORDS = 5
+
+
+def count_tokens(text):
+    # Same ~4 characters per token estimate the scheduler budgets with
+    return len(text) // 4
+
+
+def _is_reply_header(text):
+    match = _REPLY_HEADER_RE.match(text)
+    if not match or not _HEADER_DATE_RE.search(text):
+        return False
+    return bool(_HEADER_ADDRESS_RE.search(text) or _HEADER_SENDER_RE.match(match.group(3)))
+
+
+def _history_start(lines):
+    for i, line in enumerate(lines):
+        if not line.strip() or line.lstrip().startswith(">"):
+            continue
+        # Reply headers are often wrapped over two lines by the mail client
+        if _is_reply_header(line) or (i + 1 < len(lines) and _is_reply_header(line + " " + lines[i + 1])):
+            return i
+        if _SEPARATOR_RE.match(line) or _SIGNATURE_DELIMITER_RE.match(line):
+            return i
+        if _HEADER_FROM_RE.match(line) and any(_HEADER_FIELD_RE.match(next_line) for next_line in lines[i + 1:i + 4]):
+            return i
+    return None
+
+
+def clean_email(text):
+    original = text or ""
+    lines = original.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    removed = []
+
+    start = _history_start(lines)
+    if start is not None and any(line.strip() for line in lines[:start]):
+        removed.append("\n".join(lines[start:]))
+        lines = lines[:start]
+
+    kept = []
+    for line in lines:
+        if line.lstrip().startswith(">") or _MOBILE_FOOTER_RE.match(line):
+            removed.append(line)
+        else:
+            kept.append(line)
+
+    body = [paragraph for paragraph in re.split(r"\n\s*\n", "\n".join(kept)) if paragraph.strip()]
+    sign_off = next((i for i, paragraph in enumerate(body) if _SIGN_OFF_RE.search(paragraph)), None)
+    if sign_off is not None:
+        disclaimers = []
+        while len(body) > sign_off + 1 and _DISCLAIMER_RE.search(body[-1]):
+            disclaimers.insert(0, body.pop())
+        removed.extend(disclaimers)
+
+    cleaned = "\n\n".join(paragraph.strip("\n") for paragraph in body).strip()
+    if len(_GREETING_RE.sub("", cleaned, count=1).split()) < MIN_BODY_WORDS:
+        return CleanedEmail(original.strip(), original, [], 0)
+    return CleanedEmail(cleaned, original, removed, max(0, count_tokens(original) - count_tokens(cleaned)))
@@ -0,0 +1,150 @@
+# Picks the model for each LLM call from a routing table: a simple address change
+# or tax certificate question doesn't need the model a delicate complaint does.
+# Calls whose answer fails validation are escalated to the next larger model.
+#
+#   MAILGEN_ROUTES='{"refine_response": [{"demands": ["unsubscribe"], "model": "gpt-4o-mini"}, {"model": "gpt-4o"}]}'
+#   MAILGEN_ROUTER_MAX_COST=0.01 MAILGEN_ROUTER_MAX_SECONDS=20 MAILGEN_ROUTING_LOG=routing.jsonl
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+
+from mailgen_cache import content_key
+from mailgen_classifier import normalize_labels
+from mailgen_metrics import current_session, estimate_cost, metrics
+from mailgen_scheduler import COMPLETION_TOKENS_ESTIMATE
+
+# Cheapest first; escalation moves one step up
+MODEL_LADDER = os.environ.get("MAILGEN_MODEL_LADDER", "gpt-4o-mini,gpt-4o").split(",")
+
+# Acknowledgements that follow the examples closely
+SIMPLE_DEMANDS = ["data change", "tax certificate", "unsubscribe"]
+
+# Per stage, the first rule whose conditions all hold gives the model. Conditions:
+# "demands" (every detected demand is in the list), "max_chars" (email length)
+ROUTES = {
+    # Cheap first: an answer naming no known demand type is escalated to gpt-4o
+    "detect_demands": [{"model": "gpt-4o-mini"}],
+    "select_relevant_responses": [{"demands": SIMPLE_DEMANDS, "max_chars": 1500, "model": "gpt-4o-mini"}, {"model": "gpt-4o"}],
+    "draft_initial_response": [{"demands": SIMPLE_DEMANDS, "max_chars": 1500, "model": "gpt-4o-mini"}, {"model": "gpt-4o"}],
+    "select_and_draft_response": [{"demands": SIMPLE_DEMANDS, "max_chars": 1500, "model": "gpt-4o-mini"}, {"model": "gpt-4o"}],
+    # The wording the donor reads stays on the large model
+    "refine_response": [{"model": "gpt-4o"}],
+    "compose_response": [{"model": "gpt-4o"}],
+    # A handful of flagged fixes to an otherwise finished reply
+    "repair_response": [{"model": "gpt-4o-mini"}],
+    "translate_email": [{"model": "gpt-4o-mini"}],
+}
+_routes_override = os.environ.get("MAILGEN_ROUTES", "")
+if _routes_override:
+    if os.path.exists(_routes_override):
+        with open(_routes_override, encoding="utf-8") as f:
+            ROUTES.update(json.load(f))
+    else:
+        ROUTES.update(json.loads(_routes_override))
+DEFAULT_MODEL = MODEL_LADDER[-1]
+
+# Budget per call: a model whose estimated cost (USD) or recent p95 latency (s)
+# is over budget is swapped for the next cheaper one
+MAX_COST_PER_CALL = float(os.environ.get("MAILGEN_ROUTER_MAX_COST", "0") or 0) or None
+MAX_SECONDS_PER_CALL = float(os.environ.get("MAILGEN_ROUTER_MAX_SECONDS", "0") or 0) or None
+# Prompt text around the email (instructions, guidelines, examples)
+PROMPT_OVERHEAD_TOKENS = 1500
+
+ROUTING_LOG_PATH = os.environ.get("MAILGEN_ROUTING_LOG")
+MAX_DECISIONS = 1000
+
+
+def as_labels(demands):
+    if demands is None:
+        return set()
+    if isinstance(demands, str):
+        demands = demands.split(",")
+    return normalize_labels(demands)
+
+
+class Router:
+
+    def __init__(self, routes=ROUTES, ladder=MODEL_LADDER, max_cost=MAX_COST_PER_CALL, max_seconds=MAX_SECONDS_PER_CALL,
+                 log_path=ROUTING_LOG_PATH):
+        self.routes = routes
+        self.ladder = ladder
+        self.max_cost = max_cost
+        self.max_seconds = max_seconds
+        self.log_path = log_path
+        self.version = content_key(json.dumps(routes, sort_keys=True), ",".join(ladder), max_cost, max_seconds)[:12]
+        self.decisions = deque(maxlen=MAX_DECISIONS)
+        self._lock = threading.Lock()
+
+    def choose(self, stage, demands=None, email_content=""):
+        labels = as_labels(demands)
+        chars = len(email_content or "")
+        model, reason = DEFAULT_MODEL, "no rule for stage"
+        for i, rule in enumerate(self.routes.get(stage, [])):
+            if "demands" in rule and not (labels and labels <= set(rule["demands"])):
+                continue
+            if "max_chars" in rule and chars > rule["max_chars"]:
+                continue
+            model, reason = rule["model"], f"rule {i}"
+            break
+
+        prompt_tokens = chars // 4 + PROMPT_OVERHEAD_TOKENS
+        while self._over_budget(stage, model, prompt_tokens) and self._cheaper(model) is not None:
+            model, reason = self._cheaper(model), reason + ", over budget"
+        self._log(stage, model, reason, labels, chars)
+        return model
+
+    def escalate(self, stage, model, problem):
+        # Next larger model after an answer failed validation, or None at the top of the ladder
+        larger = self._larger(model)
+        if larger is not None:
+            self._log(stage, larger, f"escalated from {model}: {problem}", set(), 0)
+        return larger
+
+    def stats(self):
+        with self._lock:
+            decisions = list(self.decisions)
+        counts = Counter((d["stage"], d["model"], d["reason"].startswith("escalated")) for d in decisions)
+        return [{"stage": stage, "model": model, "escalation": escalated, "calls": count}
+                for (stage, model, escalated), count in sorted(counts.items())]
+
+    def _over_budget(self, stage, model, prompt_tokens):
+        if self.max_cost is not None and estimate_cost(model, prompt_tokens, COMPLETION_TOKENS_ESTIMATE) > self.max_cost:
+            return True
+        if self.max_seconds is not None:
+            p95 = metrics.recent_latency(stage, model, 0.95)
+            if p95 is not None and p95 > self.max_seconds:
+                return True
+        return False
+
+    def _cheaper(self, model):
+        position = self.ladder.index(model) if model in self.ladder else len(self.ladder)
+        return self.ladder[position - 1] if position > 0 else None
+
+    def _larger(self, model):
+        if model not in self.ladder:
+            return None
+        position = self.ladder.index(model)
+        return self.ladder[position + 1] if position + 1 < len(self.ladder) else None
+
+    def _log(self, stage, model, reason, labels, chars):
+        decision = {"time": time.time(), "session": current_session(), "stage": stage, "model": model,
+                    "reason": reason, "demands": sorted(labels), "chars": chars}
+        with self._lock:
+            self.decisions.append(decision)
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(decision) + "\n")
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = Router()
+        return _router
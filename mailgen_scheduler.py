@@ -0,0 +1,264 @@
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Lower value goes first: agents waiting in the UI overtake batch jobs
+INTERACTIVE = 0
+BATCH = 10
+
+# Requests / tokens per minute and starting concurrency per model. The limits
+# are corrected from the x-ratelimit-* headers after the first response.
+MODEL_LIMITS = {
+    "gpt-4o": {"rpm": 500, "tpm": 30000, "concurrency": 8},
+    "gpt-4o-mini": {"rpm": 500, "tpm": 200000, "concurrency": 16},
+}
+MODEL_LIMITS.update(json.loads(os.environ.get("MAILGEN_RATE_LIMITS", "{}")))
+DEFAULT_LIMITS = {"rpm": 500, "tpm": 30000, "concurrency": 8}
+
+MAX_RETRIES = int(os.environ.get("MAILGEN_MAX_RETRIES", "5"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+COMPLETION_TOKENS_ESTIMATE = 600
+
+
+_priority = contextvars.ContextVar("mailgen_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def request_priority(priority):
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def estimate_tokens(messages):
+    # ~4 characters per token is close enough for budgeting
+    return sum(len(str(message.content)) for message in messages) // 4 + COMPLETION_TOKENS_ESTIMATE
+
+
+def parse_duration(value):
+    # Header values look like "1s", "6m0s", "20ms" or "0.5"
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total
+
+
+def _header(headers, name):
+    if not headers:
+        return None
+    value = headers.get(name)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def sync(self, remaining, limit=None):
+        # Trust the provider's view of the window over our own estimate
+        self._refill()
+        if limit:
+            self.capacity = limit
+        if remaining is not None:
+            self.level = min(self.level, remaining)
+
+
+class ModelGate:
+    # Admission control for one model: token buckets, a concurrency limit that
+    # adapts to rate limiting (AIMD) and a priority queue of waiting calls
+
+    def __init__(self, model, rpm, tpm, concurrency):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = concurrency
+        self.concurrency = concurrency
+        self.active = 0
+        self.rate_limited = 0
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, tokens, priority):
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    timeout = None
+                    if self._waiting[0] == ticket and self.active < self.concurrency:
+                        timeout = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                        if timeout <= 0:
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            self.active += 1
+                            return
+                    self._cond.wait(timeout)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def release(self, headers=None, rate_limited=False):
+        with self._cond:
+            self.active -= 1
+            if rate_limited:
+                self.rate_limited += 1
+                self.concurrency = max(1, self.concurrency // 2)
+                self.tokens.level = min(self.tokens.level, 0.0)
+            else:
+                self.requests.sync(_header(headers, "x-ratelimit-remaining-requests"), _header(headers, "x-ratelimit-limit-requests"))
+                self.tokens.sync(_header(headers, "x-ratelimit-remaining-tokens"), _header(headers, "x-ratelimit-limit-tokens"))
+                # Grow back one slot at a time unless the window is nearly used up
+                if self.tokens.level > 0.1 * self.tokens.capacity:
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "active": self.active,
+                "waiting": len(self._waiting),
+                "concurrency": self.concurrency,
+                "rate_limited": self.rate_limited,
+                "tokens_available": round(self.tokens.level),
+            }
+
+
+def retryable_errors():
+    # openai is imported when the first call fails, not when the app boots
+    import openai
+
+    return (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def _is_rate_limit(exc):
+    import openai
+
+    return isinstance(exc, openai.RateLimitError)
+
+
+def _retry_delay(exc, attempt):
+    response = getattr(exc, "response", None)
+    if response is not None:
+        retry_after = _header(response.headers, "retry-after-ms")
+        if retry_after is not None:
+            return retry_after / 1000
+        retry_after = parse_duration(response.headers.get("retry-after"))
+        if retry_after is not None:
+            return retry_after
+    # Full jitter exponential backoff
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _response_headers(message):
+    return (getattr(message, "response_metadata", None) or {}).get("headers")
+
+
+class Scheduler:
+
+    def __init__(self, limits=None):
+        self.limits = limits or MODEL_LIMITS
+        self._gates = {}
+        self._lock = threading.Lock()
+
+    def gate(self, model):
+        with self._lock:
+            if model not in self._gates:
+                self._gates[model] = ModelGate(model, **self.limits.get(model, DEFAULT_LIMITS))
+            return self._gates[model]
+
+    def call(self, model, tokens, fn):
+        gate = self.gate(model)
+        for attempt in range(MAX_RETRIES + 1):
+            gate.acquire(tokens, _priority.get())
+            headers, rate_limited = None, False
+            try:
+                message = fn()
+                headers = _response_headers(message)
+                return message
+            except retryable_errors() as exc:
+                rate_limited = _is_rate_limit(exc)
+                if attempt == MAX_RETRIES:
+                    raise
+                delay = _retry_delay(exc, attempt)
+            finally:
+                gate.release(headers, rate_limited)
+            time.sleep(delay)
+
+    def stream(self, model, tokens, make_iterator):
+        # Retries are only possible until the first chunk has been handed out
+        gate = self.gate(model)
+        for attempt in range(MAX_RETRIES + 1):
+            gate.acquire(tokens, _priority.get())
+            headers, rate_limited, started = None, False, False
+            try:
+                for chunk in make_iterator():
+                    if not started:
+                        headers = _response_headers(chunk)
+                        started = True
+                    yield chunk
+                return
+            except retryable_errors() as exc:
+                rate_limited = _is_rate_limit(exc)
+                if started or attempt == MAX_RETRIES:
+                    raise
+                delay = _retry_delay(exc, attempt)
+            finally:
+                gate.release(headers, rate_limited)
+            time.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            gates = dict(self._gates)
+        return {model: gate.stats() for model, gate in gates.items()}
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
@@ -0,0 +1,214 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from mailgen_cache import content_key
+from mailgen_metrics import metrics
+
+DEFAULT_STORE_PATH = os.environ.get("MAILGEN_CACHE_PATH", ".mailgen_cache.sqlite")
+DEFAULT_MAX_ENTRIES = int(os.environ.get("MAILGEN_CACHE_MAX_ENTRIES", "5000"))
+
+# Stages whose LLM answers may be served from the store
+STAGE_CACHE = {
+    "detect_demands": True,
+    "select_relevant_responses": True,
+    "draft_initial_response": True,
+    "refine_response": True,
+    "select_and_draft_response": True,
+    "compose_response": True,
+    "repair_response": True,
+    "translate_email": True,
+}
+for _stage in os.environ.get("MAILGEN_CACHE_DISABLED_STAGES", "").split(","):
+    if _stage.strip() in STAGE_CACHE:
+        STAGE_CACHE[_stage.strip()] = False
+
+
+def response_key(stage, model, temperature, prompt):
+    return content_key(stage, model, temperature, prompt)
+
+
+class ResponseStore(ABC):
+    # Backend interface: anything with get/set/clear/stats can be plugged in
+
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    @abstractmethod
+    def set(self, key, stage, model, response):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+    @abstractmethod
+    def stats(self):
+        pass
+
+
+class MemoryResponseStore(ResponseStore):
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, stage, model, response):
+        with self._lock:
+            self._data[key] = response
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {"backend": "memory", "entries": len(self._data), "max_entries": self.max_entries}
+
+
+class SQLiteResponseStore(ResponseStore):
+
+    def __init__(self, path=DEFAULT_STORE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, stage TEXT, model TEXT, response TEXT, "
+            "created_at REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def set(self, key, stage, model, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, stage, model, response, now, now),
+            )
+            # Evict least recently used rows above the size cap
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, COUNT(*) FROM responses GROUP BY stage").fetchall()
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": sum(count for _, count in rows),
+            "max_entries": self.max_entries,
+            "per_stage": dict(rows),
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_response_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            backend = os.environ.get("MAILGEN_CACHE_BACKEND", "sqlite")
+            _store = MemoryResponseStore() if backend == "memory" else SQLiteResponseStore()
+        return _store
+
+
+def set_response_store(store):
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def cached_run(stage, chain, temperature, use_cache=True, **inputs):
+    # Serve a stored answer for an identical (stage, model, temperature, prompt);
+    # use_cache=False skips the lookup but still records the fresh answer
+    if not STAGE_CACHE.get(stage, False):
+        return chain.run(temperature, **inputs)
+    start = time.perf_counter()
+    store = get_response_store()
+    key = response_key(stage, chain.model, temperature, chain.prompt.format(**inputs))
+    if use_cache:
+        response = store.get(key)
+        if response is not None:
+            metrics.record(stage, chain.model, time.perf_counter() - start, cache_hit=True)
+            return response
+    response = chain.run(temperature, **inputs)
+    store.set(key, stage, chain.model, response)
+    return response
+
+
+def cached_run_many(stage, chain, temperature, n, use_cache=True, **inputs):
+    # Same as cached_run for chain.run_many: the n answers are stored together as a JSON list
+    if not STAGE_CACHE.get(stage, False):
+        return chain.run_many(temperature, n, **inputs)
+    start = time.perf_counter()
+    store = get_response_store()
+    key = response_key(stage, chain.model, temperature, chain.prompt.format(**inputs) + f"\n[n={n}]")
+    if use_cache:
+        response = store.get(key)
+        if response is not None:
+            metrics.record(stage, chain.model, time.perf_counter() - start, cache_hit=True)
+            return json.loads(response)
+    responses = chain.run_many(temperature, n, **inputs)
+    store.set(key, stage, chain.model, json.dumps(responses))
+    return responses
+
+
+def cached_stream(stage, chain, temperature, use_cache=True, **inputs):
+    # Same as cached_run but yields text chunks as they arrive; a stored answer
+    # is yielded in one piece and a fully streamed answer is stored at the end
+    if not STAGE_CACHE.get(stage, False):
+        yield from chain.stream(temperature, **inputs)
+        return
+    start = time.perf_counter()
+    store = get_response_store()
+    key = response_key(stage, chain.model, temperature, chain.prompt.format(**inputs))
+    if use_cache:
+        response = store.get(key)
+        if response is not None:
+            metrics.record(stage, chain.model, time.perf_counter() - start, cache_hit=True)
+            yield response
+            return
+    chunks = []
+    for chunk in chain.stream(temperature, **inputs):
+        chunks.append(chunk)
+        yield chunk
+    store.set(key, stage, chain.model, "".join(chunks))
@@ -0,0 +1,94 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+MAX_WORKERS = int(os.environ.get("MAILGEN_MAX_WORKERS", "8"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    # Bounded pool shared by every session, so parallel stages can't pile up threads
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="mailgen")
+        return _executor
+
+
+def submit(fn, *args, **kwargs):
+    # Workers inherit the caller's context (session id, request priority)
+    return get_executor().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class StageGraph:
+    # Small dependency graph of pipeline stages: a node starts as soon as all of
+    # its dependencies are done and receives their results as positional arguments
+
+    def __init__(self, executor=None):
+        self.executor = executor or get_executor()
+        self.nodes = {}
+        self.futures = {}
+        self.cancelled = threading.Event()
+        self.context = contextvars.copy_context()
+        self._launched = set()
+        self._lock = threading.Lock()
+
+    def add(self, name, fn, deps=()):
+        for dep in deps:
+            if dep not in self.nodes:
+                raise ValueError(f"Unknown dependency {dep!r} for stage {name!r}")
+        self.nodes[name] = (fn, tuple(deps))
+        self.futures[name] = Future()
+        return self
+
+    def start(self):
+        for name, (fn, deps) in self.nodes.items():
+            if not deps:
+                self._launch(name)
+        return self
+
+    def cancel(self):
+        # Stages not started yet are dropped; a running LLM call finishes but nobody waits for it
+        self.cancelled.set()
+        for future in self.futures.values():
+            future.cancel()
+
+    def result(self, name, timeout=None):
+        return self.futures[name].result(timeout)
+
+    def done(self, name=None):
+        if name is not None:
+            return self.futures[name].done()
+        return all(future.done() for future in self.futures.values())
+
+    def failed(self):
+        # Cancelled, or a stage raised: its result would only raise again, so callers rebuild the graph
+        return self.cancelled.is_set() or any(future.done() and (future.cancelled() or future.exception() is not None)
+                                              for future in self.futures.values())
+
+    def _launch(self, name):
+        with self._lock:
+            if name in self._launched:
+                return
+            self._launched.add(name)
+        self.executor.submit(self.context.copy().run, self._run, name)
+
+    def _run(self, name):
+        future = self.futures[name]
+        if self.cancelled.is_set():
+            future.cancel()
+        if not future.set_running_or_notify_cancel():
+            return
+        fn, deps = self.nodes[name]
+        try:
+            result = fn(*[self.futures[dep].result() for dep in deps])
+        except BaseException as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+        for other, (_, other_deps) in self.nodes.items():
+            if name in other_deps and all(self.futures[dep].done() for dep in other_deps):
+                self._launch(other)
@@ -0,0 +1,168 @@
+# Sentence-level translation memory: generated replies reuse many of the same
+# sentences, so only sentences never translated before are sent to the LLM.
+#
+#   python mailgen_translation.py export tm.jsonl
+#   python mailgen_translation.py import tm.jsonl
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from mailgen_cache import content_key, normalize_text
+from mailgen_store import DEFAULT_STORE_PATH
+
+MEMORY_PATH = os.environ.get("MAILGEN_TM_PATH", DEFAULT_STORE_PATH)
+MEMORY_MAX_ENTRIES = int(os.environ.get("MAILGEN_TM_MAX_ENTRIES", "50000"))
+TRANSLATION_MEMORY = os.environ.get("MAILGEN_TRANSLATION_MEMORY", "1") == "1"
+
+# Line breaks, or the spaces after a sentence-ending punctuation mark
+_SEPARATOR_RE = re.compile(r"(\s*\n\s*|(?<=[.!?…])[ \t]+)")
+
+
+def split_segments(text):
+    # Alternating [content, separator, content, ...]; joining gives back the text
+    return _SEPARATOR_RE.split(text)
+
+
+def segment_key(source_language, target_language, segment):
+    return content_key(source_language, target_language, normalize_text(segment))
+
+
+class TranslationMemory:
+
+    def __init__(self, path=MEMORY_PATH, max_entries=MEMORY_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translation_memory ("
+            "key TEXT PRIMARY KEY, source_language TEXT, target_language TEXT, "
+            "source TEXT, translation TEXT, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS translation_memory_last_access ON translation_memory (last_access)")
+        self._conn.commit()
+
+    def lookup(self, source_language, target_language, segments):
+        keys = {segment_key(source_language, target_language, segment): segment for segment in segments}
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = list(keys)[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, translation FROM translation_memory WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update(rows)
+            if found:
+                self._conn.executemany("UPDATE translation_memory SET last_access = ? WHERE key = ?",
+                                       [(time.time(), key) for key in found])
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return {keys[key]: translation for key, translation in found.items()}
+
+    def store(self, source_language, target_language, pairs):
+        now = time.time()
+        rows = [(segment_key(source_language, target_language, source), source_language, target_language, source, translation, now)
+                for source, translation in pairs]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO translation_memory VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._conn.execute(
+                "DELETE FROM translation_memory WHERE key IN ("
+                "SELECT key FROM translation_memory ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def export(self, f):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source_language, target_language, source, translation FROM translation_memory ORDER BY last_access"
+            ).fetchall()
+        for source_language, target_language, source, translation in rows:
+            f.write(json.dumps({"source_language": source_language, "target_language": target_language,
+                                "source": source, "translation": translation}, ensure_ascii=False) + "\n")
+        return len(rows)
+
+    def import_(self, f):
+        count = 0
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                self.store(entry["source_language"], entry["target_language"], [(entry["source"], entry["translation"])])
+                count += 1
+        return count
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM translation_memory").fetchone()[0]
+            total = self.hits + self.misses
+            return {"entries": entries, "max_entries": self.max_entries, "sentence_hits": self.hits,
+                    "sentence_misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+def translate_with_memory(memory, text, source_language, target_language, translate_segments):
+    # translate_segments(list of sentences) -> list of translations, or None when
+    # the model's answer can't be aligned with the input (the caller then falls back)
+    pieces = split_segments(text)
+    segments = [piece.strip() for piece in pieces[0::2] if piece.strip()]
+    known = memory.lookup(source_language, target_language, segments)
+    unseen = list(dict.fromkeys(segment for segment in segments if segment not in known))
+    if unseen:
+        translations = translate_segments(unseen)
+        if translations is None or len(translations) != len(unseen):
+            return None
+        new_pairs = list(zip(unseen, translations))
+        memory.store(source_language, target_language, new_pairs)
+        known.update(new_pairs)
+
+    result = []
+    for i, piece in enumerate(pieces):
+        if i % 2 == 0 and piece.strip():
+            leading = piece[:len(piece) - len(piece.lstrip())]
+            trailing = piece[len(piece.rstrip()):]
+            result.append(leading + known[piece.strip()] + trailing)
+        else:
+            result.append(piece)
+    return "".join(result)
+
+
+_memory = None
+_memory_lock = threading.Lock()
+
+
+def get_translation_memory():
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            _memory = TranslationMemory()
+        return _memory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import the sentence translation memory as JSONL.")
+    parser.add_argument("command", choices=["export", "import", "stats"])
+    parser.add_argument("path", nargs="?", help="JSONL file")
+    args = parser.parse_args(argv)
+
+    memory = get_translation_memory()
+    if args.command == "stats":
+        print(json.dumps(memory.stats(), indent=2))
+    elif args.command == "export":
+        with open(args.path, "w", encoding="utf-8") as f:
+            print(f"Exported {memory.export(f)} sentence pairs to {args.path}")
+    else:
+        with open(args.path, encoding="utf-8") as f:
+            print(f"Imported {memory.import_(f)} sentence pairs from {args.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# Deterministic checks of a finished reply against the rules the prompts spell out:
+# name and organization in the signature, the organization's own website, no
+# "no FURTHER payments" to a donor who never paid, and no leftover placeholders.
+# What a substitution can fix is fixed locally; the rest becomes the instruction
+# list of one small repair call instead of a new select/draft/refine run.
+import os
+import re
+import threading
+from collections import Counter
+
+VALIDATE_REPLIES = os.environ.get("MAILGEN_VALIDATE_REPLIES", "1") == "1"
+
+# The signature is looked for in the last characters of the reply
+SIGNATURE_CHARS = 300
+WEBSITES = {"Dokters van de Wereld": "doktersvandewereld.be", "Médecins du Monde": "medecinsdumonde.be"}
+_WEBSITE_RE = re.compile(r"\b(?:doktersvandewereld|m[eé]decinsdumonde)\.be\b", re.IGNORECASE)
+
+# Set in donor_info["gift_history_info"] for donors cancelling before their first gift
+NO_PAYMENT_MARKER = "THERE WILL BE NO PAYMENT"
+# Up to two words between the quantifier and the noun ("no more automatic payments",
+# "geen automatische betalingen meer"), but not "any further questions about payments"
+_MODIFIERS = r"(?:\s+(?!quest|vrag)\w+){0,2}"
+FURTHER_PAYMENTS_RE = re.compile(
+    rf"\b((no|any) (further|more){_MODIFIERS}\s+(payments?|debits?)|"
+    rf"geen (verdere|nieuwe){_MODIFIERS}\s+(betalingen|afschrijvingen)|"
+    rf"geen{_MODIFIERS}\s+(betalingen?|afschrijvingen?)\s+meer|"
+    rf"plus (de|aucun){_MODIFIERS}\s+(paiements?|prélèvements?)|"
+    rf"aucun(e)?s? (autres?|nouveaux?|nouvelles?){_MODIFIERS}\s+(paiements?|prélèvements?)|"
+    rf"aucun(e)?s?{_MODIFIERS}\s+(paiements?|prélèvements?)\s+ne(\s+\w+){{0,2}}\s+plus)\b",
+    re.IGNORECASE,
+)
+
+# Placeholders the model always has the information for (the donor's own name it may not)
+PLACEHOLDER_RE = re.compile(r"\[(your name|uw naam|votre nom|if language[^\]\n]*|only if[^\]\n]*)\]", re.IGNORECASE)
+_NAME_PLACEHOLDER_RE = re.compile(r"\[(your name|uw naam|votre nom)\]", re.IGNORECASE)
+
+
+def fix_locally(reply, name, organization):
+    # Substitutions that can't change the meaning: the agent's name for its
+    # placeholder and the organization's website for the other one's
+    if name:
+        reply = _NAME_PLACEHOLDER_RE.sub(name, reply)
+    website = WEBSITES.get(organization)
+    if website:
+        reply = _WEBSITE_RE.sub(lambda match: match.group(0) if match.group(0).lower() == website else website, reply)
+    return reply
+
+
+def unresolved_placeholders(reply, name):
+    # Without a name (batch runs with --name "", the app before one is typed) there is
+    # nothing to put in [Your Name]: it is left for the agent, not sent to a repair call
+    found = dict.fromkeys(PLACEHOLDER_RE.findall(reply))
+    return [placeholder for placeholder in found if name or not _NAME_PLACEHOLDER_RE.fullmatch(f"[{placeholder}]")]
+
+
+def check_reply(reply, donor_info, name, organization):
+    # [(rule, repair instruction)] for every rule the reply breaks
+    problems = []
+    placeholders = unresolved_placeholders(reply, name)
+    if placeholders:
+        problems.append(("placeholder", "Replace these placeholders with the actual text, or remove them: "
+                         + ", ".join(f"[{placeholder}]" for placeholder in placeholders) + "."))
+    signature = reply[-SIGNATURE_CHARS:]
+    if name and name not in signature:
+        problems.append(("name in signature", f"End the email with a signature that contains the name {name}."))
+    if organization not in signature:
+        problems.append(("organization in signature", f"End the email with a signature that contains the organization {organization}."))
+    website = WEBSITES.get(organization)
+    if website and any(match.lower() != website for match in _WEBSITE_RE.findall(reply)):
+        problems.append(("website", f"The only website to mention is www.{website}."))
+    if NO_PAYMENT_MARKER in donor_info.get("gift_history_info", "") and FURTHER_PAYMENTS_RE.search(reply):
+        problems.append(("no further payments", "The donor never made a payment: do not say there will be no FURTHER or no MORE payments; "
+                         "say there will be no payment."))
+    return problems
+
+
+class ReplyValidator:
+
+    def __init__(self):
+        self.checked = 0
+        self.passed = 0
+        self.fixed_locally = 0
+        self.repair_calls = 0
+        self.repaired = 0
+        self.failures = Counter()
+        self._lock = threading.Lock()
+
+    def validate(self, reply, donor_info, name, organization):
+        # Returns (reply with local fixes, [(rule, instruction)] still to repair)
+        broken = check_reply(reply, donor_info, name, organization)
+        fixed = fix_locally(reply, name, organization)
+        problems = check_reply(fixed, donor_info, name, organization) if fixed != reply else broken
+        with self._lock:
+            self.checked += 1
+            if not problems:
+                if fixed == reply:
+                    self.passed += 1
+                else:
+                    self.fixed_locally += 1
+            self.failures.update(rule for rule, _ in broken)
+        return fixed, problems
+
+    def record_repair(self, success):
+        with self._lock:
+            self.repair_calls += 1
+            self.repaired += bool(success)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "passed": self.passed,
+                "fixed_locally": self.fixed_locally,
+                "repair_calls": self.repair_calls,
+                "repaired": self.repaired,
+                "pass_rate": self.passed / self.checked if self.checked else 0.0,
+                "repair_rate": self.repair_calls / self.checked if self.checked else 0.0,
+                "repair_success_rate": self.repaired / self.repair_calls if self.repair_calls else 0.0,
+                "failures": dict(self.failures),
+            }
+
+
+_validator = None
+_validator_lock = threading.Lock()
+
+
+def get_validator():
+    global _validator
+    with _validator_lock:
+        if _validator is None:
+            _validator = ReplyValidator()
+        return _validator
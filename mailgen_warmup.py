@@ -0,0 +1,106 @@
+# Process warm-up. The app's own imports stay light (langchain, openai, httpx and
+# langdetect are imported on first use), and a background thread started on the
+# first script run loads them, builds the LLM clients and reads the language
+# profiles while the agent is still typing the password. The duration of every
+# step is kept for the startup report (sidebar metrics, benchmarks/bench_startup.py).
+import os
+import threading
+import time
+
+# Imported first by DBox_mailgen, so this is close to the start of the first script run
+BOOT = time.perf_counter()
+
+WARMUP = os.environ.get("MAILGEN_WARMUP", "1") == "1"
+
+_lock = threading.Lock()
+_timings = {}
+_warmup_steps = {}
+_errors = {}
+_thread = None
+_done = threading.Event()
+
+
+def record_startup(phase, seconds=None):
+    # Only the first value counts: every rerun of the script passes here again
+    with _lock:
+        _timings.setdefault(phase, round(time.perf_counter() - BOOT if seconds is None else seconds, 4))
+
+
+def _import_langchain():
+    import langchain.prompts
+    import langchain_openai
+
+
+def _import_openai():
+    import httpx
+    import openai
+
+
+def _llm_clients():
+    from mailgen_llm import get_llm
+    from mailgen_router import MODEL_LADDER
+
+    for model in MODEL_LADDER:
+        get_llm(model)
+
+
+def _language_profiles():
+    from mailgen_language import get_detector_factory
+
+    get_detector_factory()
+
+
+def _classifier():
+    from mailgen_classifier import get_classifier
+
+    get_classifier()
+
+
+def _library():
+    from mailgen_examples import get_example_index
+    from mailgen_library import get_library
+
+    get_example_index(get_library().examples())
+
+
+WARMUP_STEPS = [
+    ("openai", _import_openai),
+    ("langchain", _import_langchain),
+    ("llm clients", _llm_clients),
+    ("language profiles", _language_profiles),
+    ("demand classifier", _classifier),
+    ("prompt and example library", _library),
+]
+
+
+def _warm_up():
+    start = time.perf_counter()
+    for name, step in WARMUP_STEPS:
+        step_start = time.perf_counter()
+        try:
+            step()
+        except Exception as exc:
+            # Whatever failed here is simply loaded on first use instead
+            _errors[name] = f"{type(exc).__name__}: {exc}"
+        with _lock:
+            _warmup_steps[name] = round(time.perf_counter() - step_start, 4)
+    record_startup("warmup", time.perf_counter() - start)
+    _done.set()
+
+
+def start_warmup():
+    global _thread
+    with _lock:
+        if _thread is not None or not WARMUP:
+            return
+        _thread = threading.Thread(target=_warm_up, name="mailgen-warmup", daemon=True)
+    _thread.start()
+
+
+def wait_for_warmup(timeout=None):
+    return _done.wait(timeout)
+
+
+def startup_stats():
+    with _lock:
+        return {**_timings, "warmup_steps": dict(_warmup_steps), "warmup_errors": dict(_errors), "warmed_up": _done.is_set()}
@@ -0,0 +1,18 @@
+import argparse
+import json
+
+import mailgen_batch
+
+
+def test_half_written_line_is_terminated_before_appending(tmp_path, monkeypatch):
+    monkeypatch.setattr(mailgen_batch, "process_record", lambda record, defaults, temperature: {"id": record["id"], "response": "Merci"})
+    source = tmp_path / "emails.jsonl"
+    source.write_text(json.dumps({"id": "fr-02", "email": "Bonjour"}) + "\n", encoding="utf-8")
+    output = tmp_path / "drafts.jsonl"
+    done = json.dumps({"id": "fr-01", "response": "Réponse déjà envoyée"}, ensure_ascii=False) + "\n"
+    output.write_bytes(done.encode("utf-8") + '{"id": "nl-01", "response": "Beste, uw domiciliëring'.encode("utf-8"))
+
+    assert mailgen_batch.run_batch(str(source), str(output), argparse.Namespace(), workers=1) == (1, 0)
+    lines = output.read_text(encoding="utf-8").splitlines()
+    assert lines[0] == done.rstrip("\n")
+    assert json.loads(lines[-1]) == {"id": "fr-02", "response": "Merci"}
@@ -0,0 +1,15 @@
+import pytest
+
+from mailgen_cache import LRUCache
+
+
+def test_failed_compute_releases_its_key_lock():
+    cache = LRUCache(maxsize=10)
+
+    def fail():
+        raise RuntimeError("rate limited")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute("key", fail)
+    assert cache._key_locks == {}
+    assert cache.get_or_compute("key", lambda: "value") == "value"
@@ -0,0 +1,33 @@
+import pytest
+
+from mailgen_classifier import DemandClassifier, normalize_labels
+
+
+@pytest.mark.parametrize("email", [
+    "Je crains de ne pas recevoir mon attestation fiscale cette année.",
+    "Thanks, I have no more questions about my tax certificate.",
+    "Beste, ik wil mijn domiciliëring stopzetten. Ik wil graag weten waar mijn gift naartoe gaat.",
+    "Ik wil graag weten waar mijn gift naartoe gaat.",
+    "Ik wil mijn domiciliëring niet stopzetten, maar wel verlagen",
+    "Je ne veux pas annuler mon don, je voulais seulement vous remercier.",
+    "Ik wil niet dat jullie mijn domiciliëring stopzetten!",
+    "waarom hebben jullie mijn domiciliëring stopgezet? Ik had daar niet om gevraagd.",
+])
+def test_rules_leave_ambiguous_emails_to_the_llm(email):
+    labels, confident = DemandClassifier().classify(email)
+    assert not confident
+    assert "unsubscribe" not in labels
+
+
+@pytest.mark.parametrize("email, label", [
+    ("Beste, graag mijn domiciliëring stopzetten. Groeten, Jan", "donation cancellation"),
+    ("Bonjour, je ne veux plus recevoir de courrier de votre part.", "unsubscribe"),
+    ("Could you send me my tax certificate for 2023?", "tax certificate"),
+])
+def test_rules_decide_a_single_obvious_demand(email, label):
+    assert DemandClassifier().classify(email) == ([label], True)
+
+
+def test_empty_demands_match_no_label():
+    assert normalize_labels(["", "  ", "Tax certificate"]) == {"tax certificate"}
+    assert normalize_labels("".split(", ")) == set()
@@ -0,0 +1,39 @@
+from mailgen_dedup import fill_template, make_template
+
+EMAIL = "Beste,\n\nIk wil mijn maandelijkse gift stopzetten.\n\nMet vriendelijke groeten,\nMarie Peeters"
+ORGANIZATION = "Dokters van de Wereld"
+
+
+def test_amount_is_replaced_as_a_whole_word():
+    reply = "U steunt ons sinds 2020 van 20 euro per maand."
+    template = make_template(reply, EMAIL, "Jan", ORGANIZATION, {"type": "Regular donor", "regular_gift_amount": "20"})
+    assert template == "U steunt ons sinds 2020 van ⟦regular_gift_amount⟧ euro per maand."
+    assert fill_template(template, EMAIL, "Jan", ORGANIZATION, {"regular_gift_amount": "15"}) == "U steunt ons sinds 2020 van 15 euro per maand."
+
+
+def test_single_character_detail_is_templated():
+    reply = "U hebt ons 3 keer gesteund."
+    template = make_template(reply, EMAIL, "Jan", ORGANIZATION, {"gift_history_info": "3"})
+    assert template == "U hebt ons ⟦gift_history_info⟧ keer gesteund."
+
+
+def test_agent_name_inside_a_word_is_left_alone():
+    reply = "Ons kantoor in Antwerpen neemt contact op.\n\nAn\nDokters van de Wereld"
+    template = make_template(reply, EMAIL, "An", ORGANIZATION, {})
+    assert template == "Ons kantoor in Antwerpen neemt contact op.\n\n⟦agent_name⟧\n⟦organization⟧"
+
+
+def test_donor_name_and_first_name():
+    reply = "Beste Marie,\n\nWe hebben de gift van Marie Peeters stopgezet."
+    template = make_template(reply, EMAIL, "Jan", ORGANIZATION, {})
+    assert template == "Beste ⟦donor_first_name⟧,\n\nWe hebben de gift van ⟦donor_name⟧ stopgezet."
+
+
+def test_short_detail_appearing_twice_is_not_templated():
+    reply = "Uw gift van 3 euro wordt binnen 3 dagen stopgezet."
+    assert make_template(reply, EMAIL, "Jan", ORGANIZATION, {"regular_gift_amount": "3"}) is None
+
+
+def test_one_value_for_two_details_is_not_templated():
+    reply = "Uw laatste gift van 20 euro is goed aangekomen."
+    assert make_template(reply, EMAIL, "Jan", ORGANIZATION, {"regular_gift_amount": "20", "last_gift_amount": "20"}) is None
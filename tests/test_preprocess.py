@@ -0,0 +1,64 @@
+from mailgen_preprocess import clean_email
+
+DISCLAIMER = ("Dit bericht is vertrouwelijk en uitsluitend bestemd voor de geadresseerde. "
+              "Als u dit bericht per vergissing ontvangen hebt, verwijder het dan.")
+
+
+def test_complaint_about_confidentiality_is_kept():
+    email = ("Beste,\n\nIk wil mijn domiciliëring stopzetten.\n\n"
+             "Bovendien ben ik ontevreden: mijn gegevens werden niet vertrouwelijk behandeld en ik kreeg post van een andere organisatie.\n\n"
+             "Met vriendelijke groeten,\nMarie Peeters")
+    cleaned = clean_email(email)
+    assert "niet vertrouwelijk behandeld" in cleaned.text
+    assert cleaned.removed == []
+
+
+def test_french_paragraph_with_confidentiel_is_kept():
+    email = ("Bonjour,\n\nJe souhaite arrêter mon ordre permanent.\n\n"
+             "Je vous avais donné mon adresse en pensant que c'était confidentiel, et je reçois maintenant de la publicité.\n\n"
+             "Cordialement,\nJean Dupont")
+    assert "c'était confidentiel" in clean_email(email).text
+
+
+def test_trailing_disclaimer_after_sign_off_is_cut():
+    email = f"Beste,\n\nGraag ontvang ik mijn fiscaal attest voor 2023.\n\nMet vriendelijke groeten,\nMarie Peeters\n\n{DISCLAIMER}"
+    cleaned = clean_email(email)
+    assert DISCLAIMER not in cleaned.text
+    assert cleaned.removed == [DISCLAIMER]
+    assert cleaned.text.endswith("Marie Peeters")
+
+
+def test_disclaimer_words_before_sign_off_are_kept():
+    email = f"Beste,\n\nGraag ontvang ik mijn fiscaal attest voor 2023.\n\n{DISCLAIMER}\n\nMet vriendelijke groeten,\nMarie"
+    assert DISCLAIMER in clean_email(email).text
+
+
+def test_donor_sentence_is_not_a_reply_header():
+    email = ("Beste,\n\nOp 12 maart schreef ik jullie al dat ik mijn gift wil stopzetten, en ik kreeg als antwoord:\n"
+             "\"We hebben uw vraag goed ontvangen.\"\nSindsdien is er nog twee keer geld afgeschreven.\n\nGroeten,\nPiet")
+    cleaned = clean_email(email)
+    assert "nog twee keer geld afgeschreven" in cleaned.text
+    assert cleaned.removed == []
+
+
+def test_quoted_history_is_cut():
+    email = ("Beste,\n\nDank u, maar ik wil toch liever volledig stoppen.\n\nPiet\n\n"
+             "Op di 12 mrt. 2024 om 10:15 schreef Dokters van de Wereld <info@doktersvandewereld.be>:\n"
+             "> Beste Piet,\n> We hebben uw vraag goed ontvangen.")
+    cleaned = clean_email(email)
+    assert cleaned.text == "Beste,\n\nDank u, maar ik wil toch liever volledig stoppen.\n\nPiet"
+    assert cleaned.removed[0].startswith("Op di 12 mrt. 2024")
+
+
+def test_wrapped_english_header_without_address_is_cut():
+    email = ("Hello,\n\nPlease stop my monthly donation from next month on.\n\n"
+             "On Tue, Mar 12, 2024 at 10:15 AM\nJohn Smith wrote:\n> Dear John,")
+    assert clean_email(email).text == "Hello,\n\nPlease stop my monthly donation from next month on."
+
+
+def test_cut_that_leaves_only_the_greeting_keeps_the_original():
+    email = "Beste,\n\nOp 12 maart 2024 schreef Piet:\nIk wil stoppen met mijn maandelijkse gift."
+    cleaned = clean_email(email)
+    assert cleaned.text == email
+    assert cleaned.removed == []
+    assert cleaned.tokens_saved == 0
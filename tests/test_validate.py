@@ -0,0 +1,39 @@
+import pytest
+
+from mailgen_validate import FURTHER_PAYMENTS_RE, NO_PAYMENT_MARKER, check_reply
+
+DONOR_INFO = {"gift_history_info": NO_PAYMENT_MARKER}
+SIGNATURE = "\n\nKind regards,\nAn\nDokters van de Wereld"
+
+
+@pytest.mark.parametrize("sentence", [
+    "There will be no more automatic payments.",
+    "Er zullen geen automatische betalingen meer gebeuren.",
+    "no further direct debits will be taken",
+    "Aucun prélèvement ne sera plus effectué.",
+    "We will not collect any further payments.",
+    "There will be no further payments.",
+    "Er zullen geen verdere betalingen gebeuren.",
+    "Il n'y aura plus de prélèvements.",
+])
+def test_further_payments_are_flagged(sentence):
+    assert FURTHER_PAYMENTS_RE.search(sentence)
+    rules = [rule for rule, _ in check_reply("Dear donor,\n\n" + sentence + SIGNATURE, DONOR_INFO, "An", "Dokters van de Wereld")]
+    assert rules == ["no further payments"]
+
+
+@pytest.mark.parametrize("sentence", [
+    "There will be no payment.",
+    "Er zal geen betaling gebeuren.",
+    "Aucun prélèvement ne sera effectué.",
+    "If you have any further questions about payments, let us know.",
+])
+def test_no_payment_is_allowed(sentence):
+    assert not FURTHER_PAYMENTS_RE.search(sentence)
+
+
+def test_name_placeholder_without_a_name_is_left_for_the_agent():
+    reply = "Dear donor,\n\nThank you.\n\nKind regards,\n[Your Name]\nDokters van de Wereld"
+    assert check_reply(reply, {}, "", "Dokters van de Wereld") == []
+    assert [rule for rule, _ in check_reply(reply, {}, "An", "Dokters van de Wereld")] == ["placeholder", "name in signature"]
+    assert [rule for rule, _ in check_reply(reply + " [if language is French]", {}, "", "Dokters van de Wereld")] == ["placeholder"]